@@ -0,0 +1,40 @@
+import asyncio
+from pathlib import Path
+
+import pytest
+
+from pysbs.core import config
+from pysbs.core.build import BuildManager
+from pysbs.core.step import BuildStep
+from pysbs.c import scan
+from pysbs.misc import glob_step
+
+
+def _step_classes(cls : type) -> list[type]:
+    return [cls, *[ j for i in cls.__subclasses__() for j in _step_classes(i) ]]
+
+
+def forget_steps():
+    """Forget created steps and memoized scans, like new run of build script"""
+    for i in _step_classes(BuildStep):
+        i.by_id.clear()
+    scan.reset()
+    glob_step.reset()
+
+
+@pytest.fixture
+def database(tmp_path : Path, monkeypatch):
+    """Fresh database in temporary folder, which is also current one"""
+    monkeypatch.chdir(tmp_path)
+    forget_steps()
+    config.use_database(tmp_path / 'pysbs.db')
+    yield tmp_path
+    config.dbfile.close()
+    config.dbfile = None
+    config.dbpath = None
+    forget_steps()
+
+
+def run_build(targets, **kwargs) -> bool:
+    """Build given steps without garbage collection, returns if build succeeded"""
+    return asyncio.run(BuildManager(targets, keep_builds=None, **kwargs).build())
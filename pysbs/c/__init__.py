@@ -2,3 +2,4 @@ from .deps import CDependencyStep
 from .project import CProject
 from .compilation import CCompilationStep, CAutoCompilationStep
 from .linking import CLinkingStep
+from .archive import CArchiveStep
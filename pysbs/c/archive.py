@@ -0,0 +1,83 @@
+from pysbs.c.compilation import CCompilationStep
+from pysbs.core import gc
+from pysbs.core.config import get_database
+from pysbs.misc.exec_step import ExecBuildStep, ExecArgument
+from pathlib import Path
+import os.path
+
+
+class CArchiveStep(ExecBuildStep):
+    """
+    Step to pack objects of given compilation steps into
+    static library (`.a` archive), which can be given to
+    `CLinkingStep` as input.
+
+    If archive already exists, only changed objects are
+    replaced in it, and objects which are not used anymore
+    are removed, instead of recreating the whole archive.
+    """
+
+    # Archive is updated in place
+    remote_allowed = False
+
+    def __init__(self, steps : list[CCompilationStep], output : Path, dependencies=[], command='ar') -> None:
+        self.inputs = [ i.output for i in steps ]
+        self.output = output
+        super().__init__(command, [*dependencies, *steps], [
+            'rcs', ExecArgument(output, 'path'),
+            *[ ExecArgument(i, 'path') for i in self.inputs ]
+        ])
+        self.name = 'Archive ' + str(output)
+
+    @property
+    def input_files(self) -> list[Path]:
+        return self.inputs
+
+    @property
+    def archive_ns(self):
+        """
+        Namespace with data about archive file. Step id changes when
+        list of objects changes, but archive stays the same, so this
+        is not stored in namespace of the step.
+        """
+        return get_database().get_ns('archives').get_ns(str(self.output))
+
+    async def run(self):
+        # Versions of objects, with which archive was updated last time
+        members : dict[str, float] = self.archive_ns.get('members', {})
+        current = { str(i): os.path.getmtime(i) for i in self.inputs }
+
+        if not members or not os.path.exists(self.output):
+            if os.path.exists(self.output):
+                os.unlink(self.output)
+            ok = await self.execute(self.args)
+        else:
+            # Archive members are named by file names
+            removed = [ Path(i).name for i in members if i not in current ]
+            changed = [ i for i, ver in current.items() if members.get(i) != ver ]
+
+            ok = True
+            if removed:
+                ok = await self.execute(['d', ExecArgument(self.output, 'path'), *removed])
+            if ok and changed:
+                ok = await self.execute([
+                    'rs', ExecArgument(self.output, 'path'),
+                    *[ ExecArgument(i, 'path') for i in changed ]
+                ])
+
+        if ok:
+            self.archive_ns['members'] = current
+        else:
+            # Do not know what is in the archive now
+            self.archive_ns['members'] = {}
+
+
+def _prune() -> int:
+    # Archives, which were removed
+    ns = get_database().get_ns('archives')
+    stale = gc.stale_keys(ns)
+    for i in stale:
+        ns.get_ns(i).drop()
+    return len(stale)
+
+gc.add_pruner(_prune)
@@ -1,14 +1,28 @@
 from pysbs.c.deps import CDependencyStep
 from pysbs.c.project import CProject
+from pysbs.c import scan
+from pysbs.c.toolchain import toolchain_fingerprint, describe_toolchain_change
+from pysbs.core import metrics
 from pysbs.misc.exec_step import ExecBuildStep, ExecArgument
+from pysbs.misc.walk import walk_deps
+from pysbs.misc.executor import get_executor, ResourceUsage
 from pathlib import Path
 import os.path
+import re
+import shutil
+import tempfile
 from zlib import adler32
 
 
 class CCompilationStep(ExecBuildStep):
     """
     Step to compile given `.c` file into given `.o` file.
+
+    Fingerprint of the compiler (see `pysbs.c.toolchain`) is part of input
+    version, so objects are rebuilt when compiler changes.
+
+    If project has `collapsed_deps` set, all files source includes
+    are found by this step itself, and are part of its input version.
     """
 
     FLAGS = [
@@ -25,15 +39,234 @@ class CCompilationStep(ExecBuildStep):
             *flags
         ])
         self.name = 'Compile ' + str(input)
+        self.project = project
         self.input = input
+        self.output = output
 
     @property
     def input_files(self) -> list[Path]:
         return [self.input]
 
+    @property
+    def includes(self) -> dict[str, str]:
+        """
+        All files source includes, directly or not, with their mtimes.
+        Only for projects with `collapsed_deps`.
+        """
+        return scan.include_closure(self.project, self.input)
+
+    @property
+    def dependency_files(self) -> list[Path]:
+        if self.project.collapsed_deps:
+            return [ self.input, *map(Path, self.includes) ]
+        return self.input_files
+
+    @property
+    def remote_input_files(self) -> list[Path]:
+        if self.project.collapsed_deps:
+            return [ self.input, *map(Path, self.includes) ]
+
+        # Source and all headers found by dependency steps
+        files = { self.input }
+        walk_deps(
+            [ i for i in self.dependencies if isinstance(i, CDependencyStep) ],
+            lambda step : files.add(step.path) if isinstance(step, CDependencyStep) else None
+        )
+        return list(files)
+
+    @property
+    def output_files(self) -> list[Path]:
+        return [self.output]
+
     @property
     def input_version(self) -> str:
-        return str(os.path.getmtime(self.input))
+        metrics.count('stat')
+        version = str(os.path.getmtime(self.input)) + ' toolchain ' + toolchain_fingerprint(self.command)
+        if self.project.collapsed_deps:
+            version += ' includes ' + scan.closure_fingerprint(self.includes)
+        return version
+
+    def explain_input_change(self, old : str, new : str) -> list[str]:
+        old, _, old_includes = old.partition(' includes ')
+        new, _, new_includes = new.partition(' includes ')
+        old_mtime, _, old_toolchain = old.partition(' toolchain ')
+        new_mtime, _, new_toolchain = new.partition(' toolchain ')
+
+        result = []
+        if old_mtime != new_mtime:
+            result.append(f'{self.input} changed (mtime {old_mtime} -> {new_mtime})')
+        if old_toolchain != new_toolchain:
+            result.append(describe_toolchain_change(self.command))
+        if old_includes != new_includes:
+            # Versions of included files are stored on each run
+            before = self.ns.get('includes', {})
+            now = self.includes
+            for path in sorted(before.keys() | now.keys()):
+                if path not in before:
+                    result.append(f'{path} is now included')
+                elif path not in now:
+                    result.append(f'{path} is not included anymore')
+                elif before[path] != now[path]:
+                    result.append(f'{path} changed (mtime {before[path]} -> {now[path]})')
+        return result
+
+    async def run(self):
+        if self.project.collapsed_deps:
+            self.ns['includes'] = self.includes
+        return await super().run()
+
+    @property
+    def batch_key(self):
+        if not self.project.batch_compiles:
+            return None
+        # Everything except source and output
+        return (type(self), self.command, tuple(map(str, self.args[3:])))
+
+    @classmethod
+    async def run_batch(cls, steps : list['CCompilationStep']):
+        """
+        Compile sources of several steps by one command, in temporary
+        folder, and move objects to their places. Sources, objects of
+        which were not made, are compiled again one by one, so errors
+        are shown for the right step.
+        """
+
+        # Objects are named by sources, so same names must be in different batches
+        batches : list[dict[str, CCompilationStep]] = []
+        for step in steps:
+            name = step.input.stem + '.o'
+            for batch in batches:
+                if name not in batch:
+                    batch[name] = step
+                    break
+            else:
+                batches.append({ name: step })
+
+        for batch in batches:
+            if len(batch) == 1:
+                await next(iter(batch.values())).run()
+            else:
+                await cls._compile_together(batch)
+
+    @classmethod
+    async def _compile_together(cls, batch : dict[str, 'CCompilationStep']):
+        steps = list(batch.values())
+        first = steps[0]
+        for i in steps:
+            if i.project.collapsed_deps:
+                i.ns['includes'] = i.includes
+            i.output.parent.mkdir(parents=True, exist_ok=True)
+
+        with tempfile.TemporaryDirectory(prefix='pysbs-batch-') as tmp:
+            command = _BatchCommand(first, Path(tmp))
+            args = [
+                *[ ExecArgument(os.path.abspath(i.input), 'path') for i in steps ],
+                *[ _absolute(i) for i in first.args[3:] ]
+            ]
+
+            command._print_command(args)
+            for i in steps[1:]:
+                i.print(f'Compiled by one command with {first.input}')
+                i.print()
+
+            result = await get_executor().execute(command, args)
+            if result.usage is not None:
+                # Memory peak is shared, the rest is split evenly
+                share = len(steps)
+                for i in steps:
+                    i._record_usage(ResourceUsage(
+                        result.usage.user_time / share, result.usage.system_time / share, result.usage.max_rss,
+                        result.usage.read_blocks // share, result.usage.write_blocks // share
+                    ))
+
+            retry = []
+            for name, step in batch.items():
+                if (Path(tmp) / name).exists():
+                    shutil.move(Path(tmp) / name, step.output)
+                else:
+                    retry.append(step)
+            if result.returncode != 0 and not retry:
+                retry = steps
+
+        # Failed members print their output when compiled again
+        output = _split_output(result.output.decode(errors='replace'), steps)
+        for step in steps:
+            if step not in retry and output[step]:
+                step.print(output[step], end='')
+                step.print()
+
+        for step in retry:
+            step.print('Batch command failed, compiling separately')
+            step.print()
+            await step.run()
+
+
+ESC_SEQUENCE_RE = re.compile(r'\x1b\[[0-9;]*[A-Za-z]') #]
+
+
+def _split_output(output : str, steps : list[CCompilationStep]) -> dict[CCompilationStep, str]:
+    """
+    Split output of a batch command by source files, so each step
+    gets diagnostics of its own source. Lines which mention no
+    source belong to the source mentioned before them, `In file
+    included from` chains belong to the source they end with.
+    """
+    by_path = { os.path.abspath(i.input): i for i in steps }
+    path_re = re.compile('(?:^|\\s)(' + '|'.join(map(re.escape, by_path)) + ')[:(]')
+    lines = { i: [] for i in steps }
+    current = steps[0]
+    pending = None
+    for line in output.splitlines(keepends=True):
+        plain = ESC_SEQUENCE_RE.sub('', line)
+        if plain.startswith('In file included from'):
+            if pending:
+                lines[current] += pending
+            pending = []
+        match = path_re.search(plain)
+        if match:
+            current = by_path[match[1]]
+        if pending is None:
+            lines[current].append(line)
+            continue
+        pending.append(line)
+        if match:
+            lines[current] += pending
+            pending = None
+    if pending:
+        lines[current] += pending
+    return { i: ''.join(v) for i, v in lines.items() }
+
+
+def _absolute(arg):
+    # Batches are compiled in other folder
+    if isinstance(arg, ExecArgument) and arg.fmt == 'path':
+        return ExecArgument(os.path.abspath(arg.value), 'path')
+    if isinstance(arg, ExecArgument) and arg.fmt == 'include':
+        return ExecArgument(str(arg.value)[:2] + os.path.abspath(str(arg.value)[2:]), 'include')
+    return arg
+
+
+class _BatchCommand:
+    """
+    Command which compiles sources of several steps. Executor
+    runs it like a step, and the first step prints its command.
+    """
+
+    remote_allowed = False
+    response_file_threshold = ExecBuildStep.response_file_threshold
+
+    def __init__(self, first : CCompilationStep, folder : Path) -> None:
+        self.command = first.command
+        self.cwd = folder
+        self.env = first.env
+        self.print = first.print
+
+    def _response_file(self, args : list) -> Path:
+        return self.cwd / 'args.rsp'
+
+    _print_command = ExecBuildStep._print_command
+    _needs_response_file = ExecBuildStep._needs_response_file
+    _command_args = ExecBuildStep._command_args
 
 
 class CAutoCompilationStep(CCompilationStep):
@@ -47,9 +280,9 @@ class CAutoCompilationStep(CCompilationStep):
     def __init__(self, project: CProject, input: Path, build_dir : Path, dependencies=[], command='g++', flags=[]) -> None:
         self.obj_dir = build_dir / 'objects'
         self.output = self.obj_dir / (input.stem + '_' + str(adler32(str(input).encode())) + '.o')
-        super().__init__(project, input, self.output, dependencies + [
-            CDependencyStep(project, input)
-        ], command, flags)
+        if not project.collapsed_deps:
+            dependencies = dependencies + [ CDependencyStep(project, input) ]
+        super().__init__(project, input, self.output, dependencies, command, flags)
 
     async def run(self):
         self.obj_dir.mkdir(parents=True, exist_ok=True)
@@ -1,62 +1,204 @@
 import os.path
+from hashlib import sha1
 from pathlib import Path
-import re
+from typing import Optional
+import json
 
 import logging
 from pysbs.c.project import CProject
+from pysbs.c.scan import scan_includes, resolve_include, include_set, forget
 from pysbs.core.step import BuildStep
-from pysbs.misc.include_finder import find_includes, ExcludedZoneSpec
-
-INCLUDE_RE = re.compile(r'#include ((?:<[^>]+>)|(?:"[^"]+"))')
-
-C_EXCLUDED_ZONES = [
-    # Comments
-    ExcludedZoneSpec('/*', '*/', is_ignored_by_parser=True),
-    ExcludedZoneSpec('//', '\n', is_ignored_by_parser=True),
-    # Strings
-    ExcludedZoneSpec('"', '"', has_escapes = True)
-]
+from pysbs.core import metrics
 
 class CDependencyStep(BuildStep):
     """
     Step which makes C file depend on files it includes
     Usefull for making C sources depend on C headers.
+
+    Includes written in file are scanned once for all projects (see
+    `pysbs.c.scan`), but they are resolved by include paths of project,
+    so projects with different include paths get different steps.
+
+    If project has `lazy_deps` set, steps of included files are created
+    only when dependencies are needed. After each run step stores mtimes
+    of all files it includes (directly or not), and paths includes which
+    were not found were looked for at. If none of the files changed, and
+    none of missing ones appeared, build manager does not look at its
+    dependencies at all. Note that then new headers, which would be found
+    earlier in include paths than used ones, are not noticed until some
+    file in the chain changes.
+
+    Step of file generated by other step (see `CProject.add_generated()`)
+    depends on that step, and finds its includes only after file is made,
+    as dynamic dependencies.
     """
 
     def __init__(self, project : CProject, path : Path):
         super().__init__()
         self.project = project
         self.path = path
+        self._expanded = False
+        # Paths not found includes of this file were looked for at
+        self._missing : list[str] = []
+        self._step_id = CDependencyStep.make_id(project, path)
 
     def __postinit__(self):
         super().__postinit__()
 
-        if self.input_version != self.ns.get('include_cache_version', ''):
-            logging.debug(f'Searching includes in {self.path}')
-            self.compute_deps()
-        
+        if not self.project.lazy_deps:
+            self._expand()
+
+    @property
+    def dependencies(self) -> list[BuildStep]:
+        if not self._expanded:
+            self._expand()
+        return self._dependencies
+
+    @dependencies.setter
+    def dependencies(self, value : list[BuildStep]):
+        self._dependencies = value
+
+    @property
+    def expanded(self) -> bool:
+        return self._expanded
+
+    @property
+    def graph_version(self) -> Optional[str]:
+        # Not expanded steps find includes after graph is loaded
+        return self.input_version if self._expanded else None
+
+    def refresh_graph(self) -> bool:
+        self._dependencies = []
+        self._expanded = False
+        if not self.project.lazy_deps:
+            self._expand()
+        return True
+
+    @property
+    def generator(self) -> Optional[BuildStep]:
+        """Step which makes this file, if it is generated"""
+        return self.project.generated.get(str(self.path))
+
+    def _expand(self):
+        self._expanded = True
+
+        generator = self.generator
+        if generator is not None:
+            # Includes are found after it is made
+            self._dependencies.append(generator)
+            return
+
+        self._dependencies.extend(self._included_steps())
+
+    def _included_steps(self) -> list['CDependencyStep']:
         logging.debug(f'Resolving includes in {self.path}')
 
-        for i in self.ns['includes']:
-            resolved = self.project.resolve_include(self.path, i)
+        result = []
+        self._missing = []
+        for i in scan_includes(self.path):
+            resolved = resolve_include(self.project, self.path, i)
             if resolved:
-                self.dependencies.append(CDependencyStep(self.project, resolved))
-
-    def compute_deps(self):
-        with open(self.path, 'r') as f:
-            source = f.read()
-        include_matches = find_includes(
-            source, C_EXCLUDED_ZONES, INCLUDE_RE
-        )
-        # Regex matches `<foo.h>` or `"foo.h"`
-        includes = [i.group(1)[1:-1] for i in include_matches]
-        self.ns['includes'] = includes
-        self.ns['include_cache_version'] = self.input_version
+                result.append(CDependencyStep(self.project, resolved))
+            else:
+                # Like system headers, or not made yet
+                self._missing.extend(map(str, self.project.include_candidates(self.path, i)))
+        return result
+
+    def dynamic_dependencies(self) -> list[BuildStep]:
+        if self.generator is None or not os.path.exists(self.path):
+            return []
+        # File could be made again since it was scanned
+        forget(self.path)
+        return self._included_steps()
+
+    def subtree_unchanged(self) -> bool:
+        if not self.project.lazy_deps:
+            return False
+        closure = self.ns.get('closure')
+        if closure is None:
+            return False
+        if any(i in self.project.generated for i in closure):
+            # Generator may change it, it must be checked first
+            return False
+        for path, version in closure.items():
+            metrics.count('stat')
+            try:
+                if str(os.path.getmtime(path)) != version:
+                    return False
+            except OSError:
+                return False
+        for path in self.ns.get('missing', []):
+            # Include, which was not found, may be found now
+            metrics.count('stat')
+            if os.path.exists(path):
+                return False
+        return True
+
+    @property
+    def dependency_files(self) -> list[Path]:
+        # Files appearing where missing includes were looked for affect it too
+        if self._expanded:
+            return [self.path, *map(Path, self._missing)]
+        return [
+            self.path,
+            *[ Path(i) for i in self.ns.get('closure', {}) if i != str(self.path) ],
+            *map(Path, self.ns.get('missing', []))
+        ]
+
+    def unexpanded_ids(self) -> list[str]:
+        return [ CDependencyStep.make_id(self.project, Path(i)) for i in self.ns.get('closure', {}) if i != str(self.path) ]
+
+    def closure(self) -> dict[str, str]:
+        """
+        Get all files this one includes, directly or not, with their mtimes
+        at the time of last run (this one is included too).
+        """
+        return self._closure()[0]
+
+    def _closure(self) -> tuple[dict[str, str], list[str]]:
+        """Closure, and paths not found includes in it were looked for at"""
+        result = {}
+        missing = set()
+
+        def visit(step : 'CDependencyStep'):
+            if str(step.path) in result:
+                return
+            stored = step.ns.get('closure')
+            if stored is not None and not step.expanded:
+                result.update(stored)
+                missing.update(step.ns.get('missing', []))
+                return
+            result[str(step.path)] = step.last_time_input_version
+            for i in step.dependencies:
+                if isinstance(i, CDependencyStep):
+                    visit(i)
+            # Known after includes are found
+            missing.update(step._missing)
+
+        visit(self)
+        return result, sorted(missing)
+
+    async def run(self):
+        if self.project.lazy_deps:
+            self.ns['closure'], self.ns['missing'] = self._closure()
+
+    @staticmethod
+    def make_id(project : CProject, path : Path) -> str:
+        paths = sha1(json.dumps(include_set(project)).encode()).hexdigest()[:8]
+        return 'CDependencyStep { ' + str(path) + ' } ' + paths
 
     @property
     def step_id(self) -> str:
-        return 'CDependencyStep { ' + str(self.path) + ' }'
+        return self._step_id
 
     @property
     def input_version(self) -> str:
-       return str(os.path.getmtime(self.path))
+        metrics.count('stat')
+        try:
+            return str(os.path.getmtime(self.path))
+        except OSError:
+            # Generated file, which is not made yet
+            return self.INPUT_VERSION_NOT_EXISTENT
+
+    def explain_input_change(self, old : str, new : str) -> list[str]:
+        return [f'{self.path} changed (mtime {old} -> {new})']
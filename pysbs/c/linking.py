@@ -1,17 +1,32 @@
 import json
 from pysbs.c.project import CProject
+from pysbs.c.toolchain import toolchain_fingerprint, describe_toolchain_change
+from pysbs.core.step import BuildStep
 from pysbs.misc.exec_step import ExecBuildStep, ExecArgument
 from pathlib import Path
 import os.path
 
 
 class CLinkingStep(ExecBuildStep):
+    """
+    Step to link given object files and static libraries into
+    given executable.
+
+    Inputs can also be steps with `output` property, like
+    `CCompilationStep` or `CArchiveStep`. Their outputs are
+    linked, and steps are added to dependencies.
+
+    Fingerprint of the linker (see `pysbs.c.toolchain`) is part
+    of input version, so output is relinked when it changes.
+    """
 
     FLAGS = [
         ExecArgument('-fdiagnostics-color', 'cflag')
     ]
 
     def __init__(self, project : CProject, inputs : list[Path], output : Path, dependencies=[], command='g++', flags=[]) -> None:
+        dependencies = [ *dependencies, *[ i for i in inputs if isinstance(i, BuildStep) ] ]
+        inputs = [ i.output if isinstance(i, BuildStep) else i for i in inputs ]
         super().__init__(command, dependencies, [
             *[ ExecArgument(i, 'path') for i in inputs],
             '-o', ExecArgument(output, 'path'),
@@ -20,8 +35,26 @@ class CLinkingStep(ExecBuildStep):
         ])
         self.name = 'Link ' + str(output)
         self.inputs = inputs
+        self.output = output
 
     @property
     def input_files(self) -> list[Path]:
         return self.inputs
 
+    @property
+    def output_files(self) -> list[Path]:
+        return [self.output]
+
+    @property
+    def input_version(self) -> str:
+        return super().input_version + ' toolchain ' + toolchain_fingerprint(self.command)
+
+    def explain_input_change(self, old : str, new : str) -> list[str]:
+        old_files, _, old_toolchain = old.partition(' toolchain ')
+        new_files, _, new_toolchain = new.partition(' toolchain ')
+
+        result = super().explain_input_change(old_files, new_files) if old_files != new_files else []
+        if old_toolchain != new_toolchain:
+            result.append(describe_toolchain_change(self.command))
+        return result
+
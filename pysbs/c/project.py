@@ -1,5 +1,9 @@
 from pathlib import Path
-from typing import Optional
+from typing import Optional, TYPE_CHECKING
+from pysbs.core import metrics
+
+if TYPE_CHECKING:
+    from pysbs.core.step import BuildStep
 
 class CProject:
     """
@@ -8,17 +12,56 @@ class CProject:
     and include paths.
     """
 
-    def __init__(self, include_paths = []) -> None:
+    def __init__(self, include_paths = [], lazy_deps : bool = False, collapsed_deps : bool = False,
+                 batch_compiles : bool = False) -> None:
         self.include_paths = [
             *list(include_paths)
         ]
+        self.lazy_deps = lazy_deps
+        """
+        Create steps of included headers only when they are needed,
+        see `CDependencyStep`.
+        """
+        self.collapsed_deps = collapsed_deps
+        """
+        Do not make steps for included headers at all. Instead, all
+        files source includes are part of input version of its
+        compilation step, see `pysbs.c.scan`.
+        """
+        self.batch_compiles = batch_compiles
+        """
+        Compile several sources with the same flags by one command,
+        see `CCompilationStep.run_batch()`. Flags must not depend on
+        current folder, as command is run in other one.
+        """
+        self.generated : dict[str, 'BuildStep'] = {}
+        """Steps which make files, by paths of files, see `add_generated()`"""
+
+    def add_generated(self, step : 'BuildStep', files : Optional[list[Path]] = None):
+        """
+        Tell that `files` (by default `output_files` of step) are made
+        by given step, so sources including them are compiled after it.
+        Call this before making steps of such sources. Not supported
+        with `collapsed_deps`.
+        """
+        for i in (files if files is not None else step.output_files):
+            self.generated[str(i)] = step
+
+    def include_candidates(self, file : Path, included : str) -> list[Path]:
+        """
+        Paths include written in given file is looked for at, in order.
+        """
+        return [ i / included for i in [file.parent] + self.include_paths ]
 
     def resolve_include(self, file : Path, included : str) -> Optional[Path]:
         """
         Resolve include, written in given file.
         """
-        for i in [file.parent] + self.include_paths:
-            path = i / included
+        for path in self.include_candidates(file, included):
+            # Generated file may be not made yet
+            if str(path) in self.generated:
+                return path
+            metrics.count('stat')
             if path.exists():
                 return path
         return None
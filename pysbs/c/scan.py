@@ -0,0 +1,180 @@
+"""
+Finding all files C source includes, directly or not, without
+making a step for each of them.
+
+Includes written in each file depend only on its content, so they are
+cached in the database by file mtime, and shared by all projects (like
+debug and release configurations of one build script). Resolution of
+includes and closures of headers depend on include paths, and are
+memoized per set of them, so header included from many sources is
+scanned once, and walked once for each set of include paths.
+
+Results are memoized for the whole run of build script.
+Call `reset()` if files may change while it runs. Records of
+removed files are deleted by garbage collection (see `pysbs.core.gc`).
+"""
+
+__all__ = ['scan_includes', 'resolve_include', 'include_set', 'include_closure', 'closure_fingerprint', 'reset', 'forget']
+
+from hashlib import sha1
+from pathlib import Path
+from typing import Optional
+import json
+import os.path
+import re
+
+from pysbs.c.project import CProject
+from pysbs.core import gc, metrics
+from pysbs.core.config import get_database
+from pysbs.misc.include_finder import find_includes, ExcludedZoneSpec
+
+INCLUDE_RE = re.compile(r'#include ((?:<[^>]+>)|(?:"[^"]+"))')
+
+C_EXCLUDED_ZONES = [
+    # Comments
+    ExcludedZoneSpec('/*', '*/', is_ignored_by_parser=True),
+    ExcludedZoneSpec('//', '\n', is_ignored_by_parser=True),
+    # Strings
+    ExcludedZoneSpec('"', '"', has_escapes = True)
+]
+
+# Path -> mtime, or None if file does not exist
+_mtimes : dict[str, Optional[str]] = {}
+
+# Path -> includes written in it
+_includes : dict[str, list[str]] = {}
+
+# (include set, folder, include) -> resolved path
+_resolved : dict[tuple, Optional[Path]] = {}
+
+# (include set, path) -> closure
+_closures : dict[tuple, dict[str, str]] = {}
+
+
+def reset():
+    """Forget everything memoized"""
+    _mtimes.clear()
+    _includes.clear()
+    _resolved.clear()
+    _closures.clear()
+
+
+def forget(path : Path):
+    """Forget what is memoized about file changed while build runs, like generated one"""
+    _mtimes.pop(str(path), None)
+    _includes.pop(str(path), None)
+    # Closures of files including it are not known
+    _closures.clear()
+
+
+def _prune() -> int:
+    # Includes of removed files
+    ns = get_database().get_ns('scan')
+    stale = gc.stale_keys(ns)
+    for i in stale:
+        del ns[i]
+    return len(stale)
+
+gc.add_pruner(_prune)
+
+
+def _mtime(path : Path) -> Optional[str]:
+    key = str(path)
+    if key not in _mtimes:
+        metrics.count('stat')
+        try:
+            _mtimes[key] = str(os.path.getmtime(path))
+        except OSError:
+            _mtimes[key] = None
+    return _mtimes[key]
+
+
+def scan_includes(path : Path) -> list[str]:
+    """
+    Get includes written in given file, like `foo.h` for `#include <foo.h>`.
+    """
+    key = str(path)
+    if key in _includes:
+        return _includes[key]
+
+    ns = get_database().get_ns('scan')
+    version = _mtime(path)
+    cached = ns.get(key)
+    if version is not None and cached is not None and cached[0] == version:
+        includes = cached[1]
+    else:
+        with open(path, 'r') as f:
+            source = f.read()
+        metrics.count('scan.files')
+        metrics.count('scan.bytes', len(source))
+        with metrics.timer('scan'):
+            # Regex matches `<foo.h>` or `"foo.h"`
+            includes = [ i.group(1)[1:-1] for i in find_includes(source, C_EXCLUDED_ZONES, INCLUDE_RE) ]
+        ns[key] = (version, includes)
+
+    _includes[key] = includes
+    return includes
+
+
+def include_set(project : CProject) -> tuple:
+    """Include paths and generated files of project, which includes are resolved by"""
+    paths = tuple(map(str, project.include_paths))
+    return (paths, tuple(sorted(project.generated))) if project.generated else paths
+
+
+def resolve_include(project : CProject, file : Path, included : str) -> Optional[Path]:
+    """
+    Resolve include written in given file, like `CProject.resolve_include()`,
+    but memoized for all projects with the same include paths.
+    """
+    key = (include_set(project), str(file.parent), included)
+    if key not in _resolved:
+        _resolved[key] = project.resolve_include(file, included)
+    return _resolved[key]
+
+
+def include_closure(project : CProject, path : Path) -> dict[str, str]:
+    """
+    Get all files given one includes, directly or not
+    (not including itself), with their mtimes.
+    """
+    paths = include_set(project)
+    stack = set()
+
+    def visit(file : Path) -> tuple[dict[str, str], bool]:
+        # Returns closure, and if it is complete. It is not, when some
+        # file includes file which is being visited now (include cycle),
+        # such results are not memoized.
+        key = (paths, str(file))
+        if key in _closures:
+            return _closures[key], True
+        if str(file) in stack:
+            return {}, False
+
+        stack.add(str(file))
+        result = {}
+        complete = True
+        for i in scan_includes(file):
+            resolved = resolve_include(project, file, i)
+            if resolved is None:
+                continue
+            version = _mtime(resolved)
+            if version is None:
+                continue
+            result[str(resolved)] = version
+            sub, sub_complete = visit(resolved)
+            result.update(sub)
+            complete = complete and sub_complete
+        stack.remove(str(file))
+
+        if complete:
+            _closures[key] = result
+        return result, complete
+
+    with metrics.timer('closure'):
+        return visit(path)[0]
+
+
+def closure_fingerprint(closure : dict[str, str]) -> str:
+    """Short string, which changes when any file in closure changes"""
+    return sha1(json.dumps(sorted(closure.items())).encode()).hexdigest()[:16]
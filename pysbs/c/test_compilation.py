@@ -0,0 +1,33 @@
+from pysbs.c.compilation import _split_output
+
+
+BOLD = '\x1b[01m\x1b[K'
+RESET = '\x1b[m\x1b[K'
+
+
+class Step:
+    def __init__(self, input : str) -> None:
+        self.input = input
+
+
+def test_batch_output_is_split_by_source():
+    a = Step('/src/a.c')
+    b = Step('/src/b.c')
+    output = ''.join([
+        f'In file included from {BOLD}/src/a.c:1{RESET}:\n',
+        f'{BOLD}/src/h.h:1:13:{RESET} warning: unused variable x\n',
+        '    1 | int f(){int x;}\n',
+        f'{BOLD}/src/a.c:2:13:{RESET} warning: unused variable y\n',
+        '/src/h.h:1:15: warning: control reaches end of non-void function\n',
+        'In file included from /src/h.h:1,\n',
+        '                 from /src/b.c:1:\n',
+        '/src/g.h:1:1: error: unknown type name\n',
+        '/src/b.c:1:13: warning: unused variable z\n',
+    ])
+
+    parts = _split_output(output, [a, b])
+    assert 'h.h:1:13' in parts[a] and 'h.h:1:15' in parts[a] and 'a.c:2:13' in parts[a]
+    assert 'int f()' in parts[a]
+    assert parts[b].startswith('In file included from /src/h.h:1,')
+    assert 'g.h:1:1' in parts[b] and 'b.c:1:13' in parts[b]
+    assert parts[a] + parts[b] == output
@@ -0,0 +1,57 @@
+from pathlib import Path
+import os
+
+from conftest import forget_steps, run_build
+from pysbs.c import scan
+from pysbs.c.deps import CDependencyStep
+from pysbs.c.project import CProject
+from pysbs.core import gc
+from pysbs.core.config import get_database
+
+
+def make_step(folder : Path) -> CDependencyStep:
+    project = CProject(include_paths=[folder / 'include'], lazy_deps=True)
+    return CDependencyStep(project, folder / 'main.c')
+
+
+def test_lazy_closure_notices_changed_header(database):
+    (database / 'include').mkdir()
+    (database / 'include' / 'lib.h').write_text('int lib;\n')
+    (database / 'main.c').write_text('#include "lib.h"\n')
+    assert run_build(make_step(database))
+
+    forget_steps()
+    assert make_step(database).subtree_unchanged()
+
+    (database / 'include' / 'lib.h').write_text('int lib2;\n')
+    os.utime(database / 'include' / 'lib.h', (1, 1))
+    forget_steps()
+    assert not make_step(database).subtree_unchanged()
+
+
+def test_lazy_closure_notices_missing_header(database):
+    (database / 'include').mkdir()
+    (database / 'main.c').write_text('#include <stdio.h>\n#include "missing.h"\n')
+    assert run_build(make_step(database))
+
+    forget_steps()
+    assert make_step(database).subtree_unchanged()
+
+    # Header, which was not found last time, appears
+    (database / 'include' / 'missing.h').write_text('int missing;\n')
+    forget_steps()
+    step = make_step(database)
+    assert not step.subtree_unchanged()
+    assert run_build(step)
+    assert str(database / 'include' / 'missing.h') in step.closure()
+
+
+def test_scans_of_removed_files_are_pruned(database):
+    (database / 'main.c').write_text('#include "lib.h"\n')
+    (database / 'old.c').write_text('#include "lib.h"\n')
+    scan.scan_includes(database / 'main.c')
+    scan.scan_includes(database / 'old.c')
+
+    (database / 'old.c').unlink()
+    assert gc.prune() >= 1
+    assert get_database().get_ns('scan').keys() == [str(database / 'main.c')]
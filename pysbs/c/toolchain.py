@@ -0,0 +1,112 @@
+"""
+Fingerprints of compilers, so steps are rebuilt when compiler changes.
+
+Compiler is identified by resolved path of its binary, hash of its content,
+output of `--version` and default target (`-dumpmachine`). Running compiler
+is slow, so fingerprint is stored in the database, and computed again only
+when inode, size or mtime of the binary change.
+
+Note that only the driver binary (like `g++`) is checked, not the programs it
+runs, which is enough for normal upgrades, where they all change together.
+"""
+
+__all__ = ['toolchain_info', 'toolchain_fingerprint', 'describe_toolchain_change']
+
+from hashlib import sha256, sha1
+from typing import Optional
+import json
+import os
+import shutil
+import subprocess
+
+from pysbs.core import gc, metrics
+from pysbs.core.config import get_database
+
+MISSING_TOOLCHAIN = 'missing'
+"""Fingerprint of command which was not found"""
+
+# Command -> info, for this run of build script
+_infos : dict[str, Optional[dict]] = {}
+
+
+def _probe(command : str, path : str) -> dict:
+    metrics.count('toolchain.probes')
+
+    digest = sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+
+    def output(*args) -> str:
+        metrics.count('subprocesses')
+        try:
+            return subprocess.run([path, *args], stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                  stdin=subprocess.DEVNULL, timeout=30).stdout.decode(errors='replace').strip()
+        except (OSError, subprocess.SubprocessError):
+            return ''
+
+    version = output('--version')
+    info = {
+        'command': command,
+        'path': path,
+        'hash': digest.hexdigest(),
+        'version': version.splitlines()[0] if version else '',
+        'target': output('-dumpmachine')
+    }
+    info['fingerprint'] = sha1(json.dumps([info['path'], info['hash'], version, info['target']]).encode()).hexdigest()[:16]
+    return info
+
+
+def toolchain_info(command : str) -> Optional[dict]:
+    """
+    Get information about compiler: `path`, `hash`, `version` (first line
+    of `--version`), `target` and `fingerprint`. `None` if it is not found.
+    """
+    if command in _infos:
+        return _infos[command]
+
+    found = shutil.which(command)
+    if found is None:
+        _infos[command] = None
+        return None
+    path = os.path.realpath(found)
+
+    metrics.count('stat')
+    st = os.stat(path)
+    identity = [st.st_ino, st.st_dev, st.st_size, st.st_mtime_ns]
+
+    ns = get_database().get_ns('toolchains')
+    cached = ns.get(path)
+    if cached is not None and cached['identity'] == identity:
+        info = cached['info']
+    else:
+        info = _probe(command, path)
+        ns[path] = { 'identity': identity, 'info': info }
+
+    _infos[command] = info
+    return info
+
+
+def _prune() -> int:
+    # Compilers, which were removed
+    ns = get_database().get_ns('toolchains')
+    stale = gc.stale_keys(ns)
+    for i in stale:
+        del ns[i]
+    return len(stale)
+
+gc.add_pruner(_prune)
+
+
+def toolchain_fingerprint(command : str) -> str:
+    """Short string, which changes when compiler changes"""
+    info = toolchain_info(command)
+    return info['fingerprint'] if info is not None else MISSING_TOOLCHAIN
+
+
+def describe_toolchain_change(command : str) -> str:
+    """Message for explaining why step is rebuilt after compiler changed"""
+    info = toolchain_info(command)
+    if info is None:
+        return f'compiler {command} is not found'
+    return f'compiler {command} changed (now {info["path"]}: {info["version"] or "unknown version"})'
@@ -1,9 +1,9 @@
-from .build import build, BuildManager
+from .build import build, explain, BuildManager
 from .step import BuildStep
 from .config import use_database, PersistentNamespace
 
 __all__ = [
-    'build', 'BuildManager',
+    'build', 'explain', 'BuildManager',
     'BuildStep',
     'use_database', 'PersistentNamespace'
 ]
@@ -1,11 +1,22 @@
-__all__ = ['build']
+__all__ = ['build', 'explain']
 
 from pysbs.core.step import BuildStep
+from pysbs.core.gc import collect_garbage, DEFAULT_KEEP_BUILDS
+from pysbs.core.index import update_index
+from dataclasses import dataclass, field
+from pysbs.core.pool import PoolName
+from pysbs.core import metrics
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Any, Literal, Optional, Union
 from alive_progress import alive_bar
+import asyncio
+import math
 import traceback
+import time
 
 
 ESC_GRAY = '\x1b[90m' #]
+ESC_RED = '\x1b[91m' #]
 ESC_RESET = '\x1b[0m' #]
 HEADER_PREFIX = '----[ ' #]
 HEADER_SUFFIX = ' ]' 
@@ -13,6 +24,12 @@ HEADER_LEN = 120
 
 BUILD_FAILED_MSG = '\n\nBuild failed'
 
+PROGRESS_REFRESH = 0.25
+"""How often progress of running steps is updated, in seconds"""
+
+DEFAULT_STEP_COST = 1.0
+"""Estimated duration of step, when no step to update was ever run before"""
+
 def print_hader(name : str):
     print()
     filler_len = HEADER_LEN - len(name) - len(HEADER_PREFIX) - len(HEADER_SUFFIX)
@@ -24,76 +41,565 @@ def print_hader(name : str):
 class BuildError(Exception):
     pass
 
+
+class _Progress:
+    """
+    Progress of the build measured in estimated seconds of work,
+    taken from durations of previous runs, instead of in steps.
+    So one long step is not counted the same as a short one.
+    """
+
+    def __init__(self, manager : 'BuildManager', bar):
+        steps = manager.to_update
+        known = [ i.last_duration for i in steps if i.last_duration is not None ]
+        # Steps which never finished are guessed to be average
+        self.default = sum(known) / len(known) if known else DEFAULT_STEP_COST
+
+        self.manager = manager
+        self.bar = bar
+        self.show_running = manager.jobs > 1
+        self.cost = {}
+        self.total = 0.0
+        for i in steps:
+            self.add(i)
+        self.done = 0.0
+        self.finished = 0
+        self.running : dict[str, tuple[BuildStep, float]] = {}
+
+    def add(self, step : BuildStep):
+        """Count step to update, including ones found while building"""
+        if self.manager._can_replay(step):
+            self.cost[step.step_id] = 0
+        else:
+            self.cost[step.step_id] = step.last_duration if step.last_duration is not None else self.default
+        self.total += self.cost[step.step_id]
+
+    def start(self, step : BuildStep):
+        self.running[step.step_id] = (step, time.monotonic())
+        self.update()
+
+    def finish(self, step : BuildStep):
+        self.running.pop(step.step_id, None)
+        self.done += self.cost[step.step_id]
+        self.finished += 1
+        self.update()
+
+    def update(self):
+        now = time.monotonic()
+        work = self.done
+        for step, start in self.running.values():
+            # Step running longer than expected is not counted as done
+            work += min(now - start, self.cost[step.step_id] * 0.95)
+
+        self.bar(min(work / self.total, 1.0) if self.total else self.finished / len(self.cost))
+
+        if self.show_running and self.running:
+            names = [ i.name or i.step_id for i, _ in self.running.values() ]
+            self.bar.text(f'{len(names)} running: ' + ', '.join(names))
+
+
+@dataclass
+class DirtyReason:
+    """
+    Why step needs to be updated
+    """
+
+    kind : Literal['new', 'input', 'failed', 'dependency']
+    """
+    `new` if step was never run, `input` if its `input_version` changed,
+    `failed` if it failed last time, `dependency` if some dependency is updated.
+    """
+
+    details : list[str] = field(default_factory=list)
+    """Human-readable description of what changed"""
+
+    chain : list['BuildStep'] = field(default_factory=list)
+    """
+    For `dependency`, chain of dependencies through which change
+    came, ending with step which changed by itself.
+    """
+
 class BuildManager:
 
     # TODO: generate compile_commands
 
-    def __init__(self, last_step : 'BuildStep') -> None:
-        self.last_step = last_step
+    def __init__(self, last_steps : Union['BuildStep', list['BuildStep']], keep_builds : Optional[int] = DEFAULT_KEEP_BUILDS, jobs : int = 1,
+                 keep_going : bool = False, max_failures : Optional[int] = None,
+                 replay_failures : bool = True, gc_roots : Optional[list['BuildStep']] = None,
+                 target_names : Optional[dict[str, str]] = None) -> None:
+        """
+        `last_steps` is step or list of steps to build (targets). Steps
+        shared by several targets are checked and built once.
+
+        `keep_builds` is number of builds records of unused steps
+        are kept for. If `None`, they are never removed.
+
+        `jobs` is number of steps which can run at the same time.
+
+        By default, when some step fails, steps which are running are
+        cancelled (killing their processes), and build stops. If `keep_going`
+        is set, all steps which do not depend on failed ones are built,
+        unless number of failed steps reaches `max_failures`.
+
+        If `replay_failures` is set, steps which failed last time, and
+        neither their inputs nor dependencies changed, are not run again.
+        Instead output they printed is shown, and they fail again.
+
+        `gc_roots` are steps, records of which are kept by garbage collection,
+        by default `last_steps`. Pass all targets here, when building only some
+        of them, so records of the rest are not removed. They are also saved
+        in reverse index (see `pysbs.core.index`), with `target_names` by id.
+        """
+        self.last_steps = [last_steps] if isinstance(last_steps, BuildStep) else list(last_steps)
+        self.gc_roots = self.last_steps if gc_roots is None else gc_roots
+        self.target_names = target_names
+        self.keep_builds = keep_builds
+        self.jobs = jobs
+        self.keep_going = keep_going
+        self.max_failures = max_failures
+        self.replay_failures = replay_failures
         self.to_update = []
         self.update_ids = set()
+        self.reasons : dict[str, DirtyReason] = {}
+        self._checked : dict[str, bool] = {}
+        # Step id -> id of its last run, as far as known in this build
+        self._run_ids : dict[str, Optional[str]] = {}
+        self._batch_keys : dict[str, Any] = {}
+        self._pools : dict[PoolName, Executor] = {}
+
+    def _get_pool(self, pool : PoolName) -> Executor:
+        """
+        Pool to run Python code of steps in. Pools are created
+        when needed, and live until the end of the build.
+        """
+        if pool not in self._pools:
+            self._pools[pool] = (ThreadPoolExecutor if pool == 'thread' else ProcessPoolExecutor)(self.jobs)
+        return self._pools[pool]
 
-    async def build(self):
+    async def build(self) -> bool:
+        """Build everything needed. Returns False if build failed."""
 
         self.make_update_list()
 
+        if self.keep_builds is not None:
+            with metrics.timer('gc'):
+                collect_garbage(self.gc_roots, self.keep_builds)
+
         if len(self.to_update) == 0:
+            update_index(self.gc_roots, self.target_names, changed=False)
             print('All up to date')
-            return
+            return True
 
+        # Pools are waited for, unless build was cancelled
+        finished = False
         try:
-            with alive_bar(len(self.to_update), enrich_print=False) as bar:
+            try:
+                with alive_bar(manual=True, enrich_print=False) as bar, metrics.timer('execute'):
+                    await self._schedule(bar)
+                result = True
+            except BuildError:
+                print(BUILD_FAILED_MSG)
+                result = False
+            finished = True
+            # After steps ran, with dependencies found while building
+            update_index(self.gc_roots, self.target_names)
+            return result
+        finally:
+            for pool in self._pools.values():
+                pool.shutdown(wait=finished, cancel_futures=not finished)
+            self._pools = {}
+
+    async def _schedule(self, bar):
+        """
+        Run steps from update list, each one after all its dependencies.
+        Up to `jobs` steps are run at the same time.
+        """
+
+        # Dependencies each step waits for, and steps waiting for each step
+        waiting_for = {
+            i.step_id: { dep.step_id for dep in i.dependencies if dep.step_id in self.update_ids }
+            for i in self.to_update
+        }
+        dependents : dict[str, list[BuildStep]] = {}
+        for i in self.to_update:
+            for dep in waiting_for[i.step_id]:
+                dependents.setdefault(dep, []).append(i)
+
+        ready : list[BuildStep] = []
+        running : dict[asyncio.Task, list[BuildStep]] = {}
+        finished : set[str] = set()
+        failed : list[BuildStep] = []
+        progress = _Progress(self, bar)
+        stopping = False
+
+        def make_ready(step : BuildStep):
+            # Dependencies found now are checked, and built before the step
+            new = self._add_dynamic_dependencies(step)
+            if new:
+                first = len(self.to_update)
+                for i in new:
+                    self._make_update_list(i)
+                added = self.to_update[first:]
+
+                for i in [*added, step]:
+                    deps = new if i is step else i.dependencies
+                    waiting_for[i.step_id] = {
+                        dep.step_id for dep in deps
+                        if dep.step_id in self.update_ids and dep.step_id not in finished
+                    }
+                    for dep in waiting_for[i.step_id]:
+                        dependents.setdefault(dep, []).append(i)
+                for i in added:
+                    progress.add(i)
+                for i in added:
+                    if not waiting_for[i.step_id]:
+                        make_ready(i)
+                if waiting_for[step.step_id]:
+                    return
+            ready.append(step)
+
+        for i in list(self.to_update):
+            if not waiting_for[i.step_id]:
+                make_ready(i)
+
+        while ready or running:
+            while ready and len(running) < self.jobs and not stopping:
+                batch = self._take_batch(ready, self.jobs - len(running))
+                if len(batch) == 1:
+                    running[asyncio.create_task(self._run_step(batch[0], bar))] = batch
+                else:
+                    running[asyncio.create_task(self._run_batch(batch, bar))] = batch
+                for step in batch:
+                    progress.start(step)
+
+            if not running:
+                break
+
+            done, _ = await asyncio.wait(running, timeout=PROGRESS_REFRESH, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                progress.update()
+            for task in done:
+                for step in running.pop(task):
+                    progress.finish(step)
+                    if step._failed:
+                        # Steps depending on this one are never started
+                        failed.append(step)
+                        if not self.keep_going or (self.max_failures is not None and len(failed) >= self.max_failures):
+                            stopping = True
+                        continue
+                    finished.add(step.step_id)
+                    for i in dependents.get(step.step_id, []):
+                        waiting_for[i.step_id].discard(step.step_id)
+                        if not waiting_for[i.step_id]:
+                            make_ready(i)
+
+            if stopping and running:
+                await self._cancel(running)
+                running = {}
+
+        if failed:
+            print()
+            print(f'{ESC_RED}{len(failed)} steps failed:{ESC_RESET}')
+            for i in failed:
+                print(f'    {i.name or i.step_id}')
+            if progress.finished != len(self.to_update):
+                print(f'{len(self.to_update) - progress.finished} steps were not built')
+            raise BuildError()
+
+    async def _cancel(self, running : dict[asyncio.Task, list['BuildStep']]):
+        """
+        Cancel running steps. Their processes are killed,
+        and they will be run again next time. Steps which were
+        not started are run next time too, as dependencies run
+        in this build are newer than ones they were run with.
+        """
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
 
-                def set_step_name(name : str):
-                    if name:
-                        print_hader(name)
-                        bar.text(name)
+        for batch in running.values():
+            for step in batch:
+                step._invalidate()
+                print(f'{ESC_GRAY}Cancelled {step.name or step.step_id}{ESC_RESET}')
 
-                for i in self.to_update:
+    def _take_batch(self, ready : list['BuildStep'], free_jobs : int) -> list['BuildStep']:
+        """
+        Take next step from ready ones, together with other ready steps
+        with the same `batch_key`. Batch is made smaller, when there
+        are free jobs to run other batches with the same key.
+        """
+        step = ready.pop(0)
+        key = self._batch_key(step)
+        if key is None:
+            return [step]
 
-                    i._name_hook = set_step_name 
-                    await self._run(i)
-                    i._name_hook = None
-                    bar()
-        except BuildError:
-            print(BUILD_FAILED_MSG)
+        same = [ i for i in ready if self._batch_key(i) == key ]
+        size = min(step.max_batch_size, math.ceil((len(same) + 1) / free_jobs))
+        batch = [step, *same[:size - 1]]
+        for i in batch[1:]:
+            ready.remove(i)
+        return batch
+
+    def _batch_key(self, step : 'BuildStep'):
+        if step.step_id not in self._batch_keys:
+            # Replayed steps are not run, so not batched
+            self._batch_keys[step.step_id] = None if self._can_replay(step) else step.batch_key
+        return self._batch_keys[step.step_id]
+
+    async def _run_batch(self, steps : list['BuildStep'], bar):
+        """
+        Run several steps by one `run_batch()` call. Output
+        of each step is printed when the batch finishes.
+        """
+        outputs = { i.step_id: [] for i in steps }
+        for i in steps:
+            i._output_hook = outputs[i.step_id].append
+        bar.text(f'{steps[0].name or steps[0].step_id} and {len(steps) - 1} more')
+        try:
+            await self._run(steps)
+        finally:
+            for i in steps:
+                i._output_hook = None
+
+        for i in steps:
+            output = ''.join(outputs[i.step_id])
+            if i.name:
+                print_hader(i.name)
+            print(output, end='')
+            if i._failed:
+                i._save_failure_output(output)
+
+    async def _run_step(self, step : 'BuildStep', bar):
+        """
+        Run step, showing its output. If only one step runs at a time,
+        output is printed as it comes. Otherwise it is printed when
+        the step finishes, so output of different steps is not mixed.
+        """
+
+        if self._can_replay(step):
+            output = [step.failure_output or '', f'{ESC_GRAY}(Output of previous run, step was not run again as nothing changed){ESC_RESET}\n']
+            step._failed = True
+            metrics.count('steps.replayed')
+            if step.name:
+                print_hader(step.name)
+                bar.text(step.name)
+            print(''.join(output), end='')
+            return
+
+        if self.jobs == 1:
+            def set_step_name(name : str):
+                if name:
+                    print_hader(name)
+                    bar.text(name)
+
+            def print_output(text : str):
+                print(text, end='')
+                output.append(text)
+
+            output = []
+            step._name_hook = set_step_name
+            step._output_hook = print_output
+            step._stream_output = True
+            try:
+                await self._run([step])
+            finally:
+                step._name_hook = None
+                step._output_hook = None
+                step._stream_output = False
+        else:
+            output = []
+            step._output_hook = output.append
+            try:
+                await self._run([step])
+            finally:
+                step._output_hook = None
+
+            if step.name:
+                print_hader(step.name)
+            print(''.join(output), end='')
+
+        if step._failed:
+            step._save_failure_output(''.join(output))
+
+    def _can_replay(self, step : 'BuildStep') -> bool:
+        """Can we show output of failed step instead of running it?"""
+        return (self.replay_failures and step.replay_failures and
+                self.reasons[step.step_id].kind == 'failed' and
+                step.failure_output is not None)
 
 
     def make_update_list(self):
         self.to_update = []
         self.update_ids = set()
-        self._make_update_list(self.last_step)
+        self.reasons = {}
+        self._checked = {}
+        self._run_ids = {}
+        with metrics.timer('dirty_check'):
+            for i in self.last_steps:
+                self._make_update_list(i)
+        metrics.count('steps.checked', len(self._checked))
+        metrics.count('steps.dirty', len(self.to_update))
 
 
     def _make_update_list(self, step : 'BuildStep') -> bool:
 
-        any_deps_changed = False
+        if step.step_id in self._checked:
+            return self._checked[step.step_id]
+
+        if step.subtree_unchanged():
+            metrics.count('steps.lazy_skipped')
+            self._checked[step.step_id] = False
+            return False
+
+        self._add_dynamic_dependencies(step)
+        changed_dep = None
 
         for i in step.dependencies:
-            this_changed = self._make_update_list(i)
-            any_deps_changed = any_deps_changed or this_changed
+            if self._make_update_list(i) and changed_dep is None:
+                changed_dep = i
+
+        reason = self._own_reason(step)
+        if (reason is None or reason.kind == 'failed') and changed_dep is not None:
+            dep_reason = self.reasons[changed_dep.step_id]
+            reason = DirtyReason('dependency', chain=[changed_dep, *dep_reason.chain])
+        elif reason is None or reason.kind == 'failed':
+            rerun_dep = self._rerun_dependency(step)
+            if rerun_dep is not None:
+                reason = DirtyReason('dependency', ['was run after this step was run last time'], chain=[rerun_dep])
 
-        if (any_deps_changed or
-                step.input_version != step.last_time_input_version or
-                step.did_fail_last_time) and step.step_id not in self.update_ids:
+        self._checked[step.step_id] = reason is not None
+        if reason is not None:
             self.to_update.append(step)
             self.update_ids.add(step.step_id)
+            self.reasons[step.step_id] = reason
             return True
         return False
 
-    async def _run(self, step : 'BuildStep'):
-        step._bump_version()
-        step._reset_error()
+    def _run_id(self, step : 'BuildStep') -> Optional[str]:
+        if step.step_id not in self._run_ids:
+            self._run_ids[step.step_id] = step.last_run_id
+        return self._run_ids[step.step_id]
+
+    def _rerun_dependency(self, step : 'BuildStep') -> Optional['BuildStep']:
+        """
+        Dependency, which was run after the step was run last time (like
+        shared header, when other target was built). `None` if there is
+        no such one, or it is not known.
+        """
+        seen = step.seen_dependencies
+        if seen is None:
+            return None
+        for i in step.dependencies:
+            # Run ids are unique, so ids of other steps never match
+            if self._run_id(i) not in seen:
+                return i
+        return None
+
+    def _add_dynamic_dependencies(self, step : 'BuildStep') -> list['BuildStep']:
+        """
+        Add dependencies returned by `dynamic_dependencies()` of step
+        to its `dependencies`. Returns ones which were not there.
+        """
+        if type(step).dynamic_dependencies is BuildStep.dynamic_dependencies:
+            return []
+
+        known = { i.step_id for i in step.dependencies }
+        new = []
+        for i in step.dynamic_dependencies():
+            if i.step_id not in known:
+                known.add(i.step_id)
+                new.append(i)
+        step.dependencies.extend(new)
+        metrics.count('steps.dynamic_dependencies', len(new))
+        return new
+
+    def _own_reason(self, step : 'BuildStep') -> Optional[DirtyReason]:
+        """
+        Check if step must be updated because of itself,
+        not because of its dependencies.
+        """
+        old = step.last_time_input_version
+        if old == step.INPUT_VERSION_NOT_EXISTENT:
+            return DirtyReason('new', ['step was never run'])
+
+        new = step.input_version
+        if new != old:
+            return DirtyReason('input', step.explain_input_change(old, new))
+
+        if step.did_fail_last_time:
+            if self.replay_failures and step.replay_failures and step.failure_output is not None:
+                return DirtyReason('failed', ['step failed last time, its output will be shown again'])
+            return DirtyReason('failed', ['step failed last time'])
+
+        return None
+
+    def explain(self):
+        """
+        Print list of steps which will be updated and why,
+        without running anything.
+        """
+
+        self.make_update_list()
+
+        if len(self.to_update) == 0:
+            print('All up to date')
+            return
+
+        known = [ i.last_duration for i in self.to_update if i.last_duration is not None ]
+        print(f'{len(self.to_update)} steps to update, estimated {sum(known):.1f}s' +
+              (f' ({len(self.to_update) - len(known)} never finished before)' if len(known) != len(self.to_update) else ''))
+
+        for step in self.to_update:
+            reason = self.reasons[step.step_id]
+            cost = f'~{step.last_duration:.2f}s' if step.last_duration is not None else 'unknown time'
+            print()
+            print(f'{step.name or step.step_id} {ESC_GRAY}({cost}){ESC_RESET}')
+            if reason.kind == 'dependency':
+                cause = reason.chain[-1]
+                print('    dependency changed: ' + ' <- '.join(i.name or i.step_id for i in reason.chain))
+                # Dependency may be not updated now, but after this step was run last time
+                for line in self.reasons[cause.step_id].details if cause.step_id in self.reasons else reason.details:
+                    print(f'    {ESC_GRAY}{cause.name or cause.step_id}:{ESC_RESET} {line}')
+            else:
+                for line in reason.details:
+                    print(f'    {reason.kind}: {line}')
+
+
+    async def _run(self, steps : list['BuildStep']):
+        """Run one step, or batch of steps with the same `batch_key`"""
+        metrics.count('steps.run', len(steps))
+        for step in steps:
+            step._bump_version()
+            step._reset_error()
+            step._pool_hook = self._get_pool
+        start = time.monotonic()
         try:
-            await step.run()
+            if len(steps) == 1:
+                await steps[0].run()
+            else:
+                metrics.count('batches')
+                await type(steps[0]).run_batch(steps)
         except Exception as ex:
-            print(traceback.format_exc())
-            step.fail()
-    
-        if step._failed:
-            raise BuildError()
+            for step in steps:
+                step.print(traceback.format_exc())
+                step.fail()
+        finally:
+            for step in steps:
+                step._pool_hook = None
+        # Time of batch is split evenly
+        for step in steps:
+            step._record_duration((time.monotonic() - start) / len(steps))
+            # Even if step failed, so its output can be replayed
+            self._run_ids[step.step_id] = step._record_run({ self._run_id(i) for i in step.dependencies })
 
 
+async def build(last_steps : Union['BuildStep', list['BuildStep']], keep_builds : Optional[int] = DEFAULT_KEEP_BUILDS, jobs : int = 1,
+                keep_going : bool = False, max_failures : Optional[int] = None, replay_failures : bool = True) -> bool:
+    return await BuildManager(last_steps, keep_builds, jobs, keep_going, max_failures, replay_failures).build()
 
-async def build(last_step : 'BuildStep'):
-    await BuildManager(last_step).build()
+def explain(last_steps : Union['BuildStep', list['BuildStep']]):
+    """
+    Print which steps would be updated by `build()`, why,
+    and how long it is expected to take. Nothing is run.
+    """
+    BuildManager(last_steps).explain()
@@ -0,0 +1,132 @@
+"""
+Command line for build scripts: choose which targets to build,
+number of jobs, etc.
+
+    from pysbs.core.cli import main
+    main({ 'app': linking_step, 'tests': test_steps })
+
+Then:
+
+    python build.py                 # build all targets
+    python build.py app -j 8        # build only `app` in 8 jobs
+    python build.py 'Compile *'     # build steps with names matching pattern
+    python build.py --explain tests # show why steps of `tests` would be rebuilt
+    python build.py --affected-by src/foo.c include/bar.h
+                                    # build only targets affected by changed files
+"""
+
+__all__ = ['main', 'select_targets']
+
+from fnmatch import fnmatchcase
+from typing import Optional, Union
+import argparse
+import asyncio
+import sys
+
+from pysbs.core.build import BuildManager
+from pysbs.core.gc import DEFAULT_KEEP_BUILDS
+from pysbs.core.index import build_index, affected_steps
+from pysbs.core.step import BuildStep
+
+
+def _all_steps(roots : list[BuildStep]) -> list[BuildStep]:
+    result = {}
+    stack = list(roots)
+    while stack:
+        step = stack.pop()
+        if step.step_id in result:
+            continue
+        result[step.step_id] = step
+        stack.extend(step.dependencies)
+    return list(result.values())
+
+
+Target = Union[BuildStep, list[BuildStep]]
+"""Target is a step, or several steps built together (like shards of tests)"""
+
+
+def _target_steps(target : Target) -> list[BuildStep]:
+    return [target] if isinstance(target, BuildStep) else list(target)
+
+
+def select_targets(targets : dict[str, Target], patterns : list[str]) -> list[BuildStep]:
+    """
+    Find steps matching given patterns. Pattern is target name, or shell-style
+    pattern (`*`, `?`, `[...]`), which is matched against target names, and if
+    none match, against names and ids of all steps targets depend on.
+    Raises `KeyError` if some pattern matches nothing.
+    """
+    selected : dict[str, BuildStep] = {}
+    everything = None
+
+    for pattern in patterns:
+        found = [ step for name, target in targets.items() if fnmatchcase(name, pattern) for step in _target_steps(target) ]
+        if not found:
+            if everything is None:
+                everything = _all_steps([ i for target in targets.values() for i in _target_steps(target) ])
+            found = [
+                i for i in everything
+                if (i.name and fnmatchcase(i.name, pattern)) or fnmatchcase(i.step_id, pattern)
+            ]
+        if not found:
+            raise KeyError(pattern)
+        for i in found:
+            selected.setdefault(i.step_id, i)
+
+    return list(selected.values())
+
+
+def main(targets : Union[dict[str, Target], list[BuildStep]], default : Optional[list[str]] = None,
+         argv : Optional[list[str]] = None):
+    """
+    Parse command line, and build or explain selected targets.
+    `targets` are named steps (if list is given, names of steps are used).
+    If no targets are selected on command line, `default` ones are built,
+    or all of them. Exits with status 1 if build failed.
+    """
+    if not isinstance(targets, dict):
+        targets = { (i.name or i.step_id): i for i in targets }
+
+    parser = argparse.ArgumentParser(description='Build the project')
+    parser.add_argument('targets', nargs='*', help='Targets to build: names of targets, or patterns of step names or ids')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Number of steps run at the same time')
+    parser.add_argument('-k', '--keep-going', action='store_true', help='Build as much as possible when some steps fail')
+    parser.add_argument('--max-failures', type=int, default=None, help='With --keep-going, stop after this many failed steps')
+    parser.add_argument('--no-replay', action='store_true', help='Run steps which failed last time again, even if nothing changed')
+    parser.add_argument('--keep-builds', type=int, default=DEFAULT_KEEP_BUILDS, help='Number of builds records of unused steps are kept for')
+    parser.add_argument('--explain', action='store_true', help='Show which steps would be rebuilt and why, without building')
+    parser.add_argument('--affected-by', nargs='+', metavar='FILE', help='Only targets affected by given changed files (or files added to folders)')
+    parser.add_argument('--list', action='store_true', help='List targets and exit')
+    opts = parser.parse_args(argv)
+
+    roots = [ i for target in targets.values() for i in _target_steps(target) ]
+    affected = None
+    if opts.affected_by is not None:
+        affected = affected_steps(opts.affected_by, build_index(roots))
+
+    if opts.list:
+        for name, target in targets.items():
+            if affected is None or any(i.step_id in affected for i in _target_steps(target)):
+                print(name)
+        return
+
+    try:
+        selected = select_targets(targets, opts.targets or default or list(targets))
+    except KeyError as ex:
+        parser.error(f'nothing matches {ex.args[0]!r}, see --list for targets')
+
+    if affected is not None:
+        selected = [ i for i in selected if i.step_id in affected ]
+        if not selected:
+            print('No targets are affected')
+            return
+
+    manager = BuildManager(selected, opts.keep_builds, opts.jobs, opts.keep_going, opts.max_failures,
+                           not opts.no_replay, gc_roots=roots,
+                           target_names={ i.step_id: name for name, target in targets.items() for i in _target_steps(target) })
+    if opts.explain:
+        manager.explain()
+        return
+
+    if not asyncio.run(manager.build()):
+        sys.exit(1)
@@ -1,6 +1,10 @@
+import dbm
 import shelve
 from typing import Any, Optional
+from pathlib import Path
 import os
+import re
+from . import metrics
 
 def _esc(key : str):
     """
@@ -11,16 +15,69 @@ def _esc(key : str):
     """
     return key.replace('\\', '\\\\').replace('|', '\\|')
 
+def _unesc(key : str):
+    """Reverse of `_esc()`"""
+    return re.sub(r'\\(.)', r'\1', key)
+
+# Escaped key part, up to first non-escaped `|`
+_PART_RE = re.compile(r'[^\\|]*(?:\\.[^\\|]*)*')
+
+def _part(key : str, start : int) -> str:
+    """
+    Escaped part of key, which starts at given position.
+    Part is left escaped, so it can be compared with `_esc()`-ed names.
+    """
+    return _PART_RE.match(key, start).group()
+
 # Shelf where we put persistent data
 dbfile : Optional[shelve.Shelf] = None
 
+# Path shelf was opened with
+dbpath : Optional[Path] = None
+
+DB_SUFFIXES = ['', '.db', '.dat', '.dir', '.bak']
+"""Suffixes of files `dbm` backends add to database path"""
+
 def use_database(file : os.PathLike):
     """
     Use file at given path to store all data between
     compilations.
     """
-    global dbfile
-    dbfile = shelve.open(file)
+    global dbfile, dbpath
+    with metrics.timer('db.open'):
+        dbfile = shelve.open(file)
+    dbpath = Path(file)
+
+def compact_database():
+    """
+    Rewrite database file, leaving only live records in it.
+    Backends like `dbm.dumb` never reuse space of overwritten
+    or deleted values, so file grows with every build.
+
+    The same shelf is used after that, so namespaces made
+    before stay valid.
+    """
+    if dbfile is None or dbpath is None:
+        raise RuntimeError("Database file was not opened! Use `use_database()` to that")
+
+    tmp_path = dbpath.with_name(dbpath.name + '.compact')
+    with shelve.open(tmp_path, 'n') as new:
+        for key in dbfile:
+            new[key] = dbfile[key]
+    dbfile.sync()
+    dbfile.dict.close()
+
+    # Backend may store database in several files with different
+    # suffixes, like `.dat` and `.dir`. Only files it made for the new
+    # database are moved, each replacing old one at once, so other files
+    # with similar names are never touched.
+    for suffix in DB_SUFFIXES:
+        new_file = tmp_path.with_name(tmp_path.name + suffix)
+        if new_file.is_file():
+            new_file.replace(dbpath.with_name(dbpath.name + suffix))
+
+    # Backend of the shelf is replaced, like `shelve.open()` makes it
+    dbfile.dict = dbm.open(str(dbpath), 'c')
 
 def get_database() -> 'PersistentNamespace':
     """
@@ -47,14 +104,35 @@ class PersistentNamespace:
         return PersistentNamespace(self.db, self.prefix + '|' + _esc(name))
 
     def __getitem__(self, name : str):
-        return self.db[self.prefix + '|' + _esc(name)]
+        metrics.count('db.reads')
+        with metrics.timer('db'):
+            return self.db[self.prefix + '|' + _esc(name)]
 
     def get(self, name : str, default : Any = None):
-        return self.db.get(self.prefix + '|' + _esc(name), default)
+        metrics.count('db.reads')
+        with metrics.timer('db'):
+            return self.db.get(self.prefix + '|' + _esc(name), default)
 
     def __setitem__(self, name : str, val : Any):
-        self.db[self.prefix + '|' + _esc(name)] = val
-        self.db.sync()
+        metrics.count('db.writes')
+        with metrics.timer('db'):
+            self.db[self.prefix + '|' + _esc(name)] = val
+            self.db.sync()
+
+    def __delitem__(self, name : str):
+        metrics.count('db.writes')
+        with metrics.timer('db'):
+            del self.db[self.prefix + '|' + _esc(name)]
+            self.db.sync()
+
+    def keys(self) -> list[str]:
+        """Names of keys and subnamespaces in this namespace"""
+        prefix = self.prefix + '|'
+        names = {}
+        for key in self.db:
+            if key.startswith(prefix):
+                names[_unesc(_part(key, len(prefix)))] = None
+        return list(names)
 
     def drop(self):
         """Delete this namespace with all its child keys"""
@@ -0,0 +1,146 @@
+"""
+Garbage collection of step records in the database.
+
+Every change of flags, file renames, etc. make new step ids,
+but records of old steps are never read again. So on each
+build we mark steps reachable from the built ones, and
+remove records of steps which were not seen for several builds.
+
+Other namespaces (like caches of scanned files) are cleaned by
+pruners, registered with `add_pruner()`. They usually check if
+files records are about still exist, so they are run only once
+in `keep_builds` builds.
+"""
+
+__all__ = ['collect_garbage', 'mark_reachable', 'sweep', 'add_pruner', 'prune', 'stale_keys']
+
+from typing import Callable
+import os
+import sys
+from pysbs.core import config
+from pysbs.core.config import get_database, _esc, _part
+from pysbs.core.step import BuildStep
+
+DEFAULT_KEEP_BUILDS = 10
+"""Number of builds step may be not used in before its records are removed"""
+
+Pruner = Callable[[], int]
+"""Function, which removes stale records and returns their number"""
+
+# Registered pruners
+pruners : list[Pruner] = []
+
+
+def add_pruner(pruner : Pruner):
+    """
+    Register function, which removes stale records of some
+    namespace, other than `steps`. See `prune()`.
+    """
+    pruners.append(pruner)
+
+
+def prune() -> int:
+    """Run all pruners, returns number of removed records"""
+    return sum(i() for i in pruners)
+
+
+def stale_keys(ns : config.PersistentNamespace) -> list[str]:
+    """Keys of namespace, which are paths of files not existing anymore"""
+    return [ i for i in ns.keys() if not os.path.exists(i) ]
+
+
+def mark_reachable(last_steps : list[BuildStep]):
+    """
+    Start new build generation and mark all steps given steps
+    depend on (and steps themselves) as seen in it.
+    """
+    ns = get_database().get_ns('gc')
+    generation = ns.get('generation', 0) + 1
+    seen = ns.get('last_seen', {})
+
+    visited = set()
+
+    def visit(step : BuildStep):
+        if step.step_id in visited:
+            return
+        visited.add(step.step_id)
+        seen[_esc(step.step_id)] = generation
+        if not step.expanded:
+            # Do not create dependencies just to mark them
+            for i in step.unexpanded_ids():
+                seen[_esc(i)] = generation
+            return
+        for i in step.dependencies:
+            visit(i)
+
+    for i in last_steps:
+        visit(i)
+
+    ns['last_seen'] = seen
+    ns['generation'] = generation
+
+
+def sweep(keep_builds : int = DEFAULT_KEEP_BUILDS) -> int:
+    """
+    Remove records of steps which were not marked as seen for
+    `keep_builds` generations. Returns number of removed steps.
+    """
+    ns = get_database().get_ns('gc')
+    generation = ns.get('generation', 0)
+    last_seen = ns.get('last_seen', {})
+    steps_ns = get_database().get_ns('steps')
+
+    # Steps are keyed by escaped id in the database,
+    # `last_seen` is keyed by escaped ids too.
+    prefix = steps_ns.prefix + '|'
+    start = len(prefix)
+
+    changed = False
+    dead = set()
+    del_list = []
+    for key in steps_ns.db:
+        if not key.startswith(prefix):
+            continue
+        step = _part(key, start)
+        if step not in last_seen:
+            # Record from before garbage collection was used, give it a chance
+            last_seen[step] = generation
+            changed = True
+        if last_seen[step] + keep_builds < generation:
+            dead.add(step)
+            del_list.append(key)
+
+    for key in del_list:
+        del steps_ns.db[key]
+    steps_ns.db.sync()
+
+    if dead or changed:
+        ns['last_seen'] = { k: v for k, v in last_seen.items() if k not in dead }
+
+    return len(dead)
+
+
+def collect_garbage(last_steps : list[BuildStep], keep_builds : int = DEFAULT_KEEP_BUILDS) -> int:
+    """
+    Mark steps used in this build and sweep ones which
+    were not used for `keep_builds` builds. Once in
+    `keep_builds` builds pruners are run too.
+    """
+    mark_reachable(last_steps)
+    removed = sweep(keep_builds)
+    if get_database().get_ns('gc')['generation'] % max(keep_builds, 1) == 0:
+        removed += prune()
+    return removed
+
+
+if __name__ == '__main__':
+
+    # Usage: python -m pysbs.core.gc path/to/pysbs.db
+    # Rewrites the database, so space of deleted records is returned.
+
+    if len(sys.argv) != 2:
+        print(f'Usage: {sys.argv[0]} <database>')
+        sys.exit(1)
+
+    config.use_database(sys.argv[1])
+    config.compact_database()
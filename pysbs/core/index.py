@@ -0,0 +1,153 @@
+"""
+Reverse index of the graph: which steps read each file, and which
+steps depend on each step. It is saved by builds, which ran some steps
+(graph can change only then) or built other targets, so files changed
+in a commit can be mapped to targets they affect without making the
+graph:
+
+    python -m pysbs.core.index path/to/pysbs.db src/foo.c include/bar.h
+
+Files are taken from `dependency_files` of steps. If folder is there
+(like searched by `GlobStep`), files inside it affect the step too, so
+added files are noticed.
+"""
+
+__all__ = ['build_index', 'update_index', 'load_index', 'affected_steps', 'affected_targets']
+
+from hashlib import sha1
+from typing import Optional
+import json
+import os
+import sys
+
+from pysbs.core import config, metrics
+from pysbs.core.config import get_database
+from pysbs.core.step import BuildStep
+
+
+def build_index(targets : list[BuildStep], names : Optional[dict[str, str]] = None) -> dict:
+    """
+    Make index of graph of given targets. Steps are numbered, as ids
+    may be long. Index has `steps` (ids by number), `files` (path ->
+    numbers of steps reading it), `dependents` (numbers of steps which
+    depend on each step) and `targets` (id of target -> its name, taken
+    from `names` by id, or name of the step).
+    """
+    numbers : dict[str, int] = {}
+    files : dict[str, list[int]] = {}
+    dependents : list[list[int]] = []
+
+    def visit(step : BuildStep) -> int:
+        # Ids of some steps are made from all their arguments, so they are taken once
+        step_id = step.step_id
+        if step_id in numbers:
+            return numbers[step_id]
+        number = numbers[step_id] = len(numbers)
+        dependents.append([])
+
+        for i in step.dependency_files:
+            files.setdefault(os.path.abspath(i), []).append(number)
+
+        if not step.expanded:
+            # Files of unexpanded dependencies are in `dependency_files`
+            return number
+        for i in step.dependencies:
+            dependents[visit(i)].append(number)
+        return number
+
+    with metrics.timer('index'):
+        for i in targets:
+            visit(i)
+
+    return {
+        'steps': list(numbers),
+        'files': files,
+        'dependents': dependents,
+        'targets': _target_names(targets, names)
+    }
+
+
+def _target_names(targets : list[BuildStep], names : Optional[dict[str, str]] = None) -> dict[str, str]:
+    names = names or {}
+    return { i.step_id: names.get(i.step_id, i.name or i.step_id) for i in targets }
+
+
+def update_index(targets : list[BuildStep], names : Optional[dict[str, str]] = None, changed : bool = True):
+    """
+    Save index of graph of given targets into the database. If `changed`
+    is False (no steps were run), graph is not walked, unless targets
+    are not the same as in saved index. It is written only if it changed.
+    """
+    ns = get_database().get_ns('index')
+    if not changed:
+        with metrics.timer('index'):
+            if ns.get('targets') == _target_names(targets, names):
+                return
+
+    index = build_index(targets, names)
+    with metrics.timer('index'):
+        version = sha1(json.dumps(index).encode()).hexdigest()
+        if ns.get('version') != version:
+            ns['index'] = index
+            ns['version'] = version
+            ns['targets'] = index['targets']
+
+
+def load_index() -> Optional[dict]:
+    """Index saved by last build, `None` if there is no one"""
+    return get_database().get_ns('index').get('index')
+
+
+def affected_steps(paths : list[str], index : dict) -> set[str]:
+    """
+    Ids of steps which read given files (or folders containing them),
+    and of all steps depending on them.
+    """
+    files : dict[str, list[int]] = index['files']
+    dependents : list[list[int]] = index['dependents']
+
+    stack = []
+    for path in paths:
+        path = os.path.abspath(path)
+        # Folders containing the file too
+        while True:
+            stack.extend(files.get(path, []))
+            parent = os.path.dirname(path)
+            if parent == path:
+                break
+            path = parent
+
+    result = set()
+    while stack:
+        number = stack.pop()
+        if number in result:
+            continue
+        result.add(number)
+        stack.extend(dependents[number])
+    return { index['steps'][i] for i in result }
+
+
+def affected_targets(paths : list[str], index : dict) -> dict[str, str]:
+    """Targets affected by given files, as id -> name"""
+    affected = affected_steps(paths, index)
+    return { step_id: name for step_id, name in index['targets'].items() if step_id in affected }
+
+
+if __name__ == '__main__':
+
+    # Usage: python -m pysbs.core.index path/to/pysbs.db <changed files...>
+    # Prints names of targets affected by changed files.
+
+    if len(sys.argv) < 2:
+        print(f'Usage: {sys.argv[0]} <database> <files...>')
+        sys.exit(1)
+
+    config.use_database(sys.argv[1])
+    index = load_index()
+    if index is None:
+        print('No index in the database, build the project first', file=sys.stderr)
+        sys.exit(1)
+
+    # Several steps may be one target, like shards of tests
+    for name in dict.fromkeys(affected_targets(sys.argv[2:], index).values()):
+        print(name)
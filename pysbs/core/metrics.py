@@ -0,0 +1,114 @@
+"""
+Counters and timers of build phases: how long graph construction,
+invalidation, dirty checking, database I/O and running steps took,
+how many files were stat-ed and scanned, how many processes were
+launched, etc.
+
+Use `report_at_exit()` in build script to print summary or dump
+it as JSON when build script finishes, or `add_collector()` to
+receive each measurement as it is made.
+"""
+
+__all__ = ['count', 'timer', 'add_collector', 'reset', 'snapshot', 'print_summary', 'dump_json', 'report_at_exit']
+
+import atexit
+import json
+import os
+import time
+from contextlib import contextmanager
+from typing import Callable, Literal, Optional
+
+Collector = Callable[[Literal['counter', 'timer'], str, float], None]
+
+counters : dict[str, float] = {}
+"""Counter name -> value"""
+
+timers : dict[str, float] = {}
+"""Timer name -> seconds spent in it"""
+
+collectors : list[Collector] = []
+
+# Timers which are running now, to not count time of recursive ones twice
+_running : dict[str, int] = {}
+
+
+def count(name : str, n : float = 1):
+    """Increase counter by `n`"""
+    counters[name] = counters.get(name, 0) + n
+    for i in collectors:
+        i('counter', name, n)
+
+
+@contextmanager
+def timer(name : str):
+    """
+    Context manager, which adds time spent inside it to given timer.
+    If timer is entered recursively, only outer one counts.
+    """
+    if _running.get(name, 0):
+        _running[name] += 1
+        try:
+            yield
+        finally:
+            _running[name] -= 1
+        return
+
+    _running[name] = 1
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _running[name] = 0
+        spent = time.perf_counter() - start
+        timers[name] = timers.get(name, 0) + spent
+        for i in collectors:
+            i('timer', name, spent)
+
+
+def add_collector(collector : Collector):
+    """
+    Register function, which is called on each measurement with its
+    kind (`counter` or `timer`), name and value (increment or seconds).
+    """
+    collectors.append(collector)
+
+
+def reset():
+    """Clear all counters and timers"""
+    counters.clear()
+    timers.clear()
+
+
+def snapshot() -> dict:
+    return {
+        'counters': dict(counters),
+        'timers': dict(timers)
+    }
+
+
+def print_summary():
+    """Print all timers and counters"""
+    print()
+    print('Build metrics:')
+    for name, value in sorted(timers.items()):
+        print(f'    {name:32} {value:10.3f}s')
+    for name, value in sorted(counters.items()):
+        print(f'    {name:32} {value:10g}')
+
+
+def dump_json(path : os.PathLike):
+    with open(path, 'w') as f:
+        json.dump(snapshot(), f, indent=2)
+
+
+def report_at_exit(summary : bool = True, json_path : Optional[os.PathLike] = None):
+    """
+    Print summary and/or write metrics into JSON file
+    when build script finishes.
+    """
+    def report():
+        if summary:
+            print_summary()
+        if json_path is not None:
+            dump_json(json_path)
+    atexit.register(report)
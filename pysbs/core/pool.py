@@ -0,0 +1,77 @@
+"""
+Running CPU-heavy Python code of steps in thread or process
+pools, so it does not block other steps running at the same time.
+"""
+
+__all__ = ['StepFailure', 'pooled', 'PoolName']
+
+import functools
+from typing import TYPE_CHECKING, Any, Callable, Literal
+
+if TYPE_CHECKING:
+    from pysbs.core.step import BuildStep
+
+PoolName = Literal['thread', 'process']
+
+
+class StepFailure(Exception):
+    """
+    Raise this from function running in a pool to fail the step.
+    Message of the exception is printed as output of the step.
+    """
+    pass
+
+
+def _run_pooled(step : 'BuildStep', name : str, args : tuple) -> tuple[Any, bool, str]:
+    """
+    Run method of the step, decorated by `pooled()`, inside pool. For process
+    pools step is a pickled copy, so instead of touching the database, we return
+    result, if step failed and its output, to apply them to real step.
+
+    Method is passed by name, because undecorated function cannot be pickled.
+    """
+    fn = getattr(type(step), name).__wrapped__
+    output = []
+    old_hook, old_in_pool = step._output_hook, step._in_pool
+    step._output_hook = output.append
+    step._in_pool = True
+    try:
+        result = fn(step, *args)
+    except StepFailure as ex:
+        if str(ex):
+            step.print(str(ex))
+        step.fail()
+        result = None
+    finally:
+        step._output_hook, step._in_pool = old_hook, old_in_pool
+    return result, step._failed, ''.join(output)
+
+
+def _run_function(fn : Callable, args : tuple) -> tuple[Any, bool, str]:
+    """Same as `_run_pooled()`, but for functions not bound to steps"""
+    try:
+        return fn(*args), False, ''
+    except StepFailure as ex:
+        return None, True, str(ex) + '\n' if str(ex) else ''
+
+
+def pooled(pool : PoolName = 'thread'):
+    """
+    Decorator for synchronous `run()` (or other method) of a step,
+    which makes it run in thread or process pool of the build manager.
+
+    `self.print()` and `self.fail()` work inside it as usual.
+    For process pools, step must be picklable, and changes
+    to it made inside the method are not seen outside. Step is
+    sent there without its `dependencies`, so the graph below
+    it is not pickled with every call.
+    """
+
+    def decorator(fn : Callable):
+        @functools.wraps(fn)
+        async def wrapper(self : 'BuildStep', *args):
+            step = self._pool_copy() if pool == 'process' else self
+            return await self._call_in_pool(pool, _run_pooled, step, fn.__name__, args)
+        return wrapper
+
+    return decorator
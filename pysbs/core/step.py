@@ -1,7 +1,14 @@
 __all__ = ["BuildStep"]
 
-from typing import Type, Callable, Optional
+from typing import Type, Callable, Optional, Any, Hashable
+from concurrent.futures import Executor
+from pathlib import Path
+import asyncio
+import os
+import zlib
 from . import config
+from . import metrics
+from .pool import PoolName, _run_function
 
 # Version returned by 
 
@@ -12,12 +19,14 @@ class _BuildStepMetaclass(type):
     """
 
     def __call__(self : Type['BuildStep'], *args, **kwargs):
-        step = self.__new__(self, *args, **kwargs) 
-        step.__init__(*args, **kwargs)
+        with metrics.timer('graph'):
+            step = self.__new__(self, *args, **kwargs) 
+            step.__init__(*args, **kwargs)
 
-        if step.step_id not in self.by_id:
-            step.__postinit__()
-            self.by_id[step.step_id] = step
+            if step.step_id not in self.by_id:
+                metrics.count('steps.created')
+                step.__postinit__()
+                self.by_id[step.step_id] = step
 
         return self.by_id[step.step_id]
 
@@ -40,7 +49,8 @@ class BuildStep(metaclass=_BuildStepMetaclass):
     dict to see if it is a duplicate. If it is, you will be given already
     created one.
 
-    TODO: clean db from unused steps
+    Records of steps which are not used anymore are removed
+    by `pysbs.core.gc` after several builds.
     """
 
     by_id : dict[str, 'BuildStep']
@@ -56,6 +66,13 @@ class BuildStep(metaclass=_BuildStepMetaclass):
     INPUT_VERSION_NOT_EXISTENT = ''
     """Version returned when this step data did not exist on previous run"""
 
+    replay_failures = True
+    """
+    If this step failed, and nothing changed, show output of
+    previous run instead of running it again. Disable this for
+    steps which depend on something not tracked by pysbs.
+    """
+
     ### User-defined methods ###############################
 
     @property
@@ -82,17 +99,148 @@ class BuildStep(metaclass=_BuildStepMetaclass):
         """
         pass
 
+    def explain_input_change(self, old : str, new : str) -> list[str]:
+        """
+        Describe what changed, when `input_version` changed from
+        `old` to `new`. Used to explain why step is rebuilt.
+        """
+        return [f'input version changed from {old!r} to {new!r}']
+
+    ### Batching ###########################################
+
+    max_batch_size = 32
+    """Max number of steps run by one `run_batch()` call"""
+
+    @property
+    def batch_key(self) -> Optional[Hashable]:
+        """
+        Steps with the same key (not `None`), which can be run at
+        the same time, may be run together by one `run_batch()` call.
+        """
+        return None
+
+    @classmethod
+    async def run_batch(cls, steps : list['BuildStep']):
+        """
+        Run several steps with the same `batch_key` at once,
+        like compiling several files with one command.
+        """
+        for i in steps:
+            await i.run()
+
+    ### Lazy dependencies ##################################
+
+    # Steps may create their dependencies only when `dependencies`
+    # is first read. Build manager asks `subtree_unchanged()` before
+    # reading it, so unchanged parts of the graph are never created.
+
+    def subtree_unchanged(self) -> bool:
+        """
+        Return True if it is known, without looking at dependencies,
+        that neither this step nor any step it depends on changed
+        since they were last run.
+        """
+        return False
+
+    @property
+    def expanded(self) -> bool:
+        """False while dependencies of a lazy step are not created yet"""
+        return True
+
+    def unexpanded_ids(self) -> list[str]:
+        """
+        Ids of all steps this one depends on (directly or not),
+        while it is not expanded. Used to not remove their records.
+        """
+        return []
+
+    @property
+    def dependency_files(self) -> list[Path]:
+        """
+        Files this step reads itself (not through dependencies), and for
+        not expanded step, files read by its dependencies. Used to find
+        steps affected by changed files, see `pysbs.core.index`.
+        """
+        return []
+
+    ### Dynamic dependencies ###############################
+
+    # Some dependencies are known only after other steps run, like
+    # includes of generated header. Build manager asks for them when
+    # step is checked, and again when all dependencies of step were
+    # built, and adds new ones to `dependencies`, building them first.
+
+    def dynamic_dependencies(self) -> list['BuildStep']:
+        """
+        Dependencies found from results of other dependencies of this
+        step (like files made by them). Called when step is checked,
+        with results of previous build, and again each time all its
+        dependencies were built in this one.
+        """
+        return []
+
+    ### Graph snapshots ####################################
+
+    @property
+    def graph_version(self) -> Optional[str]:
+        """
+        Version of things dependencies of this step were found from
+        (like includes of a file), if they are not fixed by build script.
+        If it changes, `refresh_graph()` is called on graph loaded
+        from snapshot. See `pysbs.misc.snapshot`.
+        """
+        return None
+
+    def refresh_graph(self) -> bool:
+        """
+        Find dependencies again, after `graph_version` changed. Returns
+        False, if step cannot do that, and graph must be made again.
+        """
+        return False
+
     ### Internal methods ###################################
 
     def __init__(self, dependencies = []) -> None:
         self.__m_name = ""
         self.__m_name_hook = None
+        self._output_hook : Optional[Callable[[str], None]] = None
+        # Output can be printed while step runs, not when it finishes
+        self._stream_output = False
+        self._pool_hook : Optional[Callable[[PoolName], Executor]] = None
+        self._in_pool = False
         self._failed = False
         self.dependencies = list(dependencies)
 
     def __postinit__(self):
         self.__m_ns = config.get_database().get_ns('steps').get_ns(self.step_id)
 
+    def __getstate__(self):
+        # Database and hooks cannot be pickled
+        state = dict(self.__dict__)
+        for i in ['_BuildStep__m_ns', '_BuildStep__m_name_hook', '_output_hook', '_pool_hook']:
+            state.pop(i, None)
+        return state
+
+    def _pool_copy(self) -> 'BuildStep':
+        """
+        Copy of this step to pickle for process pool, without
+        dependencies. Snapshots (`pysbs.misc.snapshot`) pickle
+        steps themselves, and need dependencies.
+        """
+        copy = object.__new__(type(self))
+        copy.__dict__.update(self.__getstate__())
+        copy.dependencies = []
+        return copy
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__m_name_hook = None
+        self._output_hook = None
+        self._stream_output = False
+        self._pool_hook = None
+        if config.dbfile is not None:
+            self.__m_ns = config.get_database().get_ns('steps').get_ns(self.step_id)
+
     @property
     def name(self):
         return self.__m_name
@@ -118,6 +266,17 @@ class BuildStep(metaclass=_BuildStepMetaclass):
         """Namespace for storing data of this step."""
         return self.__m_ns
 
+    def print(self, *args, sep : str = ' ', end : str = '\n'):
+        """
+        Print output of this step. Use it instead of `print()`,
+        so output of steps running in parallel is not mixed.
+        """
+        text = sep.join(map(str, args)) + end
+        if self._output_hook is not None:
+            self._output_hook(text)
+        else:
+            print(text, end='')
+
     def fail(self):
         """
         Make this step fail.
@@ -125,8 +284,37 @@ class BuildStep(metaclass=_BuildStepMetaclass):
         printed next time build will be run without this
         inputs changing.
         """
-        self.ns['has_failed'] = True
         self._failed = True
+        if not self._in_pool:
+            # Inside pool it is set by the step outside
+            self.ns['has_failed'] = True
+
+    async def run_in_pool(self, fn : Callable, *args, pool : PoolName = 'process') -> Any:
+        """
+        Run CPU-heavy function in process or thread pool of build manager,
+        so other steps are not blocked, and return its result. For process
+        pool function and arguments must be picklable.
+
+        If function raises `pysbs.core.pool.StepFailure`, step fails.
+        To run whole `run()` in pool, see `pysbs.core.pool.pooled`.
+        """
+        return await self._call_in_pool(pool, _run_function, fn, args)
+
+    async def _call_in_pool(self, pool : PoolName, *call) -> Any:
+        """
+        Run `call` in given pool. It must return result, did step fail,
+        and output of step, which are applied to this step.
+        """
+        executor = self._pool_hook(pool) if self._pool_hook is not None else None
+        if executor is None and pool == 'process':
+            raise RuntimeError('Process pool is available only for steps run by `BuildManager`')
+
+        result, failed, output = await asyncio.get_running_loop().run_in_executor(executor, *call)
+        if output:
+            self.print(output, end='')
+        if failed:
+            self.fail()
+        return result
 
     @property
     def last_time_input_version(self) -> str:
@@ -142,18 +330,77 @@ class BuildStep(metaclass=_BuildStepMetaclass):
         """
         return self.ns.get('has_failed', False)
 
+    @property
+    def last_duration(self) -> Optional[float]:
+        """
+        How long this step took last time it was run, in seconds.
+        `None` if it was never run.
+        """
+        return self.ns.get('last_duration', None)
+
+    def _record_duration(self, duration : float):
+        self.ns['last_duration'] = duration
+
     def _bump_version(self):
         """
         Update last input version.
         """
         self.ns['last_time_input_version'] = self.input_version
 
+    @property
+    def last_run_id(self) -> Optional[str]:
+        """
+        Id of last run of this step, it is new each time step runs.
+        `None` if step was never run.
+        """
+        return self.ns.get('last_run', (None, None))[0]
+
+    @property
+    def seen_dependencies(self) -> Optional[set[Optional[str]]]:
+        """
+        Run ids of dependencies at the time this step was run last
+        time. If some dependency was run since, this step must be run
+        too, even if it was not built together with it (like when only
+        other target was built). `None` if not known.
+        """
+        return self.ns.get('last_run', (None, None))[1]
+
+    def _record_run(self, seen_dependencies : set[Optional[str]]) -> str:
+        """
+        Give finished run of this step new id, and store run ids of
+        dependencies it was run with. Returns the id.
+        """
+        run_id = os.urandom(8).hex()
+        self.ns['last_run'] = (run_id, seen_dependencies)
+        return run_id
+
+    @property
+    def failure_output(self) -> Optional[str]:
+        """
+        Output this step printed when it failed last time,
+        `None` if it was not saved.
+        """
+        data = self.ns.get('fail_message', None)
+        if not data:
+            return None
+        return zlib.decompress(data).decode()
+
+    def _save_failure_output(self, output : str):
+        self.ns['fail_message'] = zlib.compress(output.encode())
+
+    def _invalidate(self):
+        """
+        Forget that this step was run, so it is run next time.
+        Used when step was interrupted.
+        """
+        self.ns['last_time_input_version'] = self.INPUT_VERSION_NOT_EXISTENT
+
     def _reset_error(self):
         """
         Reset error stored in persistent storage
         """
         self.ns['has_failed'] = False
-        self.ns['fail_message'] = ''
+        self.ns['fail_message'] = b''
         self._failed = False
 
 class Foo(BuildStep):
@@ -0,0 +1,114 @@
+from conftest import forget_steps, run_build
+from pysbs.core.step import BuildStep
+
+# Input version of each `Value` step, by name
+values : dict[str, str] = {}
+
+# Names of steps run, in order
+runs : list[str] = []
+
+# Names of steps, which fail when run
+failing : set[str] = set()
+
+
+class Value(BuildStep):
+    """Step, input of which is changed by test"""
+
+    def __init__(self, name : str, dependencies=[]):
+        super().__init__(dependencies)
+        self.name = name
+
+    @property
+    def step_id(self):
+        return 'Value ' + self.name
+
+    @property
+    def input_version(self):
+        return values.get(self.name, '0')
+
+    async def run(self):
+        runs.append(self.name)
+        if self.name in failing:
+            self.print(f'{self.name} failed')
+            self.fail()
+
+
+def setup_function():
+    values.clear()
+    runs.clear()
+    failing.clear()
+
+
+def make_graph():
+    header = Value('header')
+    a = Value('a', [header])
+    b = Value('b', [header])
+    return header, a, b
+
+
+def test_partial_build_keeps_shared_change(database):
+    _, a, b = make_graph()
+    assert run_build([a, b])
+
+    # Target `a` is built after header changed, then `b`
+    values['header'] = '1'
+    forget_steps()
+    _, a, _ = make_graph()
+    assert run_build([a])
+    assert runs[-2:] == ['header', 'a']
+
+    runs.clear()
+    forget_steps()
+    _, _, b = make_graph()
+    assert run_build([b])
+    assert runs == ['b']
+
+
+def test_stopped_build_keeps_shared_change(database):
+    _, a, b = make_graph()
+    link = Value('link', [b, a])
+    assert run_build(link)
+
+    # `b` fails, and build stops before `a` is run
+    values['header'] = '1'
+    failing.add('b')
+    runs.clear()
+    forget_steps()
+    _, a, b = make_graph()
+    link = Value('link', [b, a])
+    assert not run_build(link)
+    assert 'a' not in runs
+
+    runs.clear()
+    failing.clear()
+    values['b'] = 'fixed'
+    forget_steps()
+    _, a, b = make_graph()
+    link = Value('link', [b, a])
+    assert run_build(link)
+    assert sorted(runs) == ['a', 'b', 'link']
+
+
+def test_failure_is_replayed_until_dependency_runs(database):
+    _, a, b = make_graph()
+    failing.add('a')
+    assert not run_build([a, b])
+
+    # Nothing changed, output is shown again
+    runs.clear()
+    forget_steps()
+    _, a, b = make_graph()
+    assert not run_build([a, b])
+    assert runs == []
+
+    # Shared dependency was run by other target
+    values['header'] = '1'
+    forget_steps()
+    _, _, b = make_graph()
+    assert run_build([b])
+
+    runs.clear()
+    forget_steps()
+    _, a, _ = make_graph()
+    assert not run_build([a])
+    assert runs == ['a']
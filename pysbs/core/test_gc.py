@@ -0,0 +1,21 @@
+from pysbs.core import config, gc
+from pysbs.core.config import get_database
+
+
+def test_compaction_keeps_namespaces(database):
+    ns = get_database().get_ns('test')
+    for i in range(10):
+        ns['key'] = i
+    config.compact_database()
+    assert ns['key'] == 9
+    ns['key'] = 10
+    assert get_database().get_ns('test')['key'] == 10
+
+
+def test_stale_keys(database):
+    (database / 'exists.c').write_text('')
+    ns = get_database().get_ns('test')
+    ns[str(database / 'exists.c')] = 1
+    ns[str(database / 'removed.c')] = 2
+    ns.get_ns(str(database / 'removed.a'))['members'] = {}
+    assert sorted(gc.stale_keys(ns)) == [str(database / 'removed.a'), str(database / 'removed.c')]
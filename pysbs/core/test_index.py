@@ -0,0 +1,35 @@
+from conftest import forget_steps, run_build
+from pysbs.core import index, test_build
+from pysbs.core.test_build import Value, values
+
+
+def setup_function():
+    test_build.setup_function()
+
+
+def test_index_is_updated_only_when_steps_ran(database, monkeypatch):
+    header = Value('header')
+    assert run_build([Value('a', [header])])
+    assert index.affected_targets([], index.load_index()) == {}
+
+    walks = []
+    build_index = index.build_index
+    monkeypatch.setattr(index, 'build_index', lambda *args: walks.append(args) or build_index(*args))
+
+    forget_steps()
+    header = Value('header')
+    assert run_build([Value('a', [header])])
+    assert walks == []
+
+    # Other targets
+    forget_steps()
+    header = Value('header')
+    assert run_build([Value('a', [header]), Value('b', [header])])
+    assert len(walks) == 1
+    assert set(index.load_index()['targets'].values()) == {'a', 'b'}
+
+    values['header'] = '1'
+    forget_steps()
+    header = Value('header')
+    assert run_build([Value('a', [header]), Value('b', [header])])
+    assert len(walks) == 2
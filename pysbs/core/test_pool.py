@@ -0,0 +1,50 @@
+import threading
+
+from conftest import run_build
+from pysbs.core.pool import pooled
+from pysbs.core.step import BuildStep
+
+
+class Unpicklable(BuildStep):
+    """Step which cannot be sent to process pool"""
+
+    def __init__(self):
+        super().__init__()
+        self.lock = threading.Lock()
+
+    @property
+    def step_id(self):
+        return 'Unpicklable'
+
+    @property
+    def input_version(self):
+        return '0'
+
+    async def run(self):
+        pass
+
+
+class Pooled(BuildStep):
+
+    def __init__(self, dependencies=[]):
+        super().__init__(dependencies)
+        self.name = 'Pooled'
+
+    @property
+    def step_id(self):
+        return 'Pooled'
+
+    @property
+    def input_version(self):
+        return '0'
+
+    @pooled('process')
+    def run(self):
+        if self.dependencies:
+            self.fail()
+
+
+def test_dependencies_are_not_sent_to_process_pool(database):
+    step = Pooled([Unpicklable()])
+    assert run_build(step)
+    assert step.dependencies
@@ -1,14 +1,18 @@
-import subprocess
-import asyncio.subprocess
+import filecmp
 import json
 import os
+import re
 
+from hashlib import sha1
 from pathlib import Path
-from typing import Any, Literal
+from typing import Any, Literal, Optional
 from dataclasses import dataclass
-from collections.abc import Callable
+from collections.abc import Callable, Iterable, Iterator
 
+from pysbs.core import config, gc, metrics
+from pysbs.core.config import get_database
 from pysbs.core.step import BuildStep
+from pysbs.misc.executor import get_executor, ResourceUsage
 from pysbs.misc.walk import walk_deps
 
 ### Escape codes for coloring output
@@ -30,6 +34,25 @@ BEST_LINE_WIDTH = 120
 
 CMD_PREF = f'{ESC_GRAY} $ {ESC_RESET}'
 CMD_ARGS_PREF = f'{ESC_GRAY} :   {ESC_RESET}'
+CMD_RSP_PREF = f'{ESC_GRAY} @   {ESC_RESET}'
+
+### Response files
+
+RESPONSE_FILE_THRESHOLD = 32000
+"""
+If command line is longer than this, arguments are passed in response
+file (`@file` argument). Windows limits command line to 32767 chars,
+Linux limits single argument to 128KiB and all of them to `ARG_MAX`.
+"""
+
+RESPONSE_FILE_DIR = 'rsp'
+"""Folder near the database, in which response files are stored"""
+
+USAGE_HISTORY_LEN = 20
+"""Number of last runs resource usage is kept for"""
+
+# Characters, which must be escaped in response files
+RSP_ESCAPED_RE = re.compile(r'([\\\s\'"])')
 
 ### Formatters used to color command arguments
 
@@ -74,6 +97,25 @@ class ExecBuildStep(BuildStep):
 
     """
 
+    remote_allowed = True
+    """
+    Can command of this step be run on other machine by
+    `RemoteExecutor`? For that `remote_input_files` and
+    `output_files` must list all files command uses.
+    """
+
+    response_file_threshold = RESPONSE_FILE_THRESHOLD
+    """
+    Max length of command line before switching to response file.
+    Set to `None` if command does not support response files.
+    """
+
+    cwd : Optional[Path] = None
+    """Folder command is run in, by default current one"""
+
+    env : Optional[dict[str, str]] = None
+    """Environment variables set for command, in addition to ones of build script"""
+
     def __init__(self, command : str, dependencies=[], args : list = []) -> None:
         super().__init__(dependencies)
         self.command = command
@@ -87,17 +129,37 @@ class ExecBuildStep(BuildStep):
         """
         return []
 
-    def _print_command(self):
+    @property
+    def dependency_files(self) -> list[Path]:
+        return self.input_files
+
+    @property
+    def remote_input_files(self) -> list[Path]:
+        """
+        Files to send to worker when command is run remotely,
+        by default `input_files`. Include headers here.
+        """
+        return self.input_files
+
+    @property
+    def output_files(self) -> list[Path]:
+        """
+        Files command produces. Used to get them back when
+        command is run remotely.
+        """
+        return []
+
+    def _print_command(self, args : list):
         """
         Print command of this step into TTY, wrapping and
         formatting flags.
         """
-        print(CMD_PREF + ESC_BOLD + self.command + ESC_RESET)
+        self.print(CMD_PREF + ESC_BOLD + self.command + ESC_RESET)
 
         lines = [CMD_ARGS_PREF]
         line_w = 0
 
-        for arg in self.args:
+        for arg in args:
             arg_str = FORMATTERS[arg.fmt](str(arg.value)) if isinstance(arg, ExecArgument) else str(arg)
             if line_w + 1 + len(arg_str) > BEST_LINE_WIDTH:
                 lines.append(CMD_ARGS_PREF)
@@ -106,46 +168,179 @@ class ExecBuildStep(BuildStep):
             line_w += len(arg_str) + 1
 
         for arg_str in lines:
-            print(arg_str)
-        print()
+            self.print(arg_str)
 
+        if self._needs_response_file(args):
+            self.print(CMD_RSP_PREF + 'passed in ' + FORMATTERS['path'](str(self._response_file(args))))
+        self.print()
 
-    async def run(self):
-        self._print_command()
+    def _response_file(self, args : list) -> Path:
+        """
+        Where response file for given arguments of this step is stored.
+        It is named by step id and the arguments, so each command
+        step runs (see `execute()`) has its own file.
+        """
+        if config.dbpath is None:
+            raise RuntimeError("Database file was not opened! Use `use_database()` to that")
+        name = sha1(json.dumps([self.step_id, list(map(str, args))]).encode()).hexdigest()[:16] + '.rsp'
+        return config.dbpath.parent / RESPONSE_FILE_DIR / name
 
-        async def reprint_stream(stream):
-            async for line in stream:
-                print(line.decode())
+    def _keep_response_file(self, args : list):
+        """
+        Response file of `args` of this step is recorded, so garbage
+        collection keeps it while the step is alive. Files of other
+        commands are not needed after they run.
+        """
+        rsp = self._response_file(args)
+        if args != self.args:
+            rsp.unlink(missing_ok=True)
+        elif self.ns.get('response_file') != rsp.name:
+            self.ns['response_file'] = rsp.name
+
+    def _needs_response_file(self, args : list) -> bool:
+        if self.response_file_threshold is None:
+            return False
+        return len(self.command) + sum(len(str(i)) + 1 for i in args) > self.response_file_threshold
+
+    def _command_args(self, args : list) -> list[str]:
+        """
+        Arguments to run command with. If command line is too
+        long, they are written into response file, and only
+        `@file` is passed. Response file is rewritten only when
+        arguments change, and arguments are part of `step_id`,
+        so it does not change identity of the step.
+        """
+        if not self._needs_response_file(args):
+            return list(map(str, args))
 
-        process = await asyncio.subprocess.create_subprocess_exec(
-                self.command, *map(str, self.args),
-                stdout = subprocess.PIPE, stderr = subprocess.PIPE
-        )
+        rsp = self._response_file(args)
+        _write_if_changed(rsp, [ RSP_ESCAPED_RE.sub(r'\\\1', str(i)) + '\n' for i in args ])
+        return ['@' + str(rsp)]
 
-        await asyncio.wait([
-            asyncio.create_task(reprint_stream(process.stdout)),
-            asyncio.create_task(reprint_stream(process.stderr))
-        ])
+
+    async def run(self):
+        await self.execute(self.args)
+
+    async def execute(self, args : list) -> bool:
+        """
+        Run command of this step with given arguments, printing
+        it and its output. Fails step and returns `False` if command
+        failed. `run()` calls this with `args` of this step.
+        """
+        self._print_command(args)
+
+        # When only this step runs, output is printed as it comes
+        streamed = []
+        def print_line(line : bytes):
+            streamed.append(line)
+            self.print(line.decode(errors='replace'), end='')
+
+        result = await get_executor().execute(self, args, print_line if self._stream_output else None)
+        if result.usage is not None:
+            self._record_usage(result.usage)
+        if self._needs_response_file(args):
+            self._keep_response_file(args)
+        if result.output and not streamed:
+            self.print(result.output.decode(errors='replace'), end='')
 
         # Some space after output
-        print()
+        self.print()
 
-        if process.returncode != 0:
-            print(f'{ESC_RED}Process returned exit code {process.returncode}, build failed{ESC_RESET}')
-            print() # More space!
+        if result.returncode != 0:
+            self.print(f'{ESC_RED}Process returned exit code {result.returncode}, build failed{ESC_RESET}')
+            self.print() # More space!
             self.fail()
+            return False
+
+        return True
 
 
+    def _record_usage(self, usage : ResourceUsage):
+        history = self.ns.get('usage_history', [])
+        history.append(usage.to_dict())
+        self.ns['usage_history'] = history[-USAGE_HISTORY_LEN:]
+
+    @property
+    def usage_history(self) -> list[ResourceUsage]:
+        """
+        Resources used by command of this step on last runs (up to
+        `USAGE_HISTORY_LEN`), oldest first. See `pysbs.misc.usage`.
+        """
+        return [ ResourceUsage(**i) for i in self.ns.get('usage_history', []) ]
+
     @property
     def step_id(self) -> str:
         return 'BuildExecStep ' + json.dumps([self.command] + list(map(str, self.args)))
 
     @property
     def input_version(self) -> str:
+        metrics.count('stat', len(self.input_files))
         return json.dumps([os.path.getmtime(i) for i in self.input_files])
 
+    def explain_input_change(self, old : str, new : str) -> list[str]:
+        try:
+            old_times, new_times = json.loads(old), json.loads(new)
+        except ValueError:
+            return super().explain_input_change(old, new)
+
+        if not isinstance(old_times, list) or len(old_times) != len(new_times) or len(new_times) != len(self.input_files):
+            return super().explain_input_change(old, new)
+
+        return [
+            f'{file} changed (mtime {old_time} -> {new_time})'
+            for file, old_time, new_time in zip(self.input_files, old_times, new_times)
+            if old_time != new_time
+        ]
+
+
+def _prune() -> int:
+    # Response files of steps, records of which were removed
+    if config.dbpath is None or not (config.dbpath.parent / RESPONSE_FILE_DIR).exists():
+        return 0
+    steps = get_database().get_ns('steps')
+    used = { steps.get_ns(i).get('response_file') for i in steps.keys() }
+    stale = [ i for i in (config.dbpath.parent / RESPONSE_FILE_DIR).iterdir() if i.name not in used ]
+    for i in stale:
+        i.unlink(missing_ok=True)
+    return len(stale)
+
+gc.add_pruner(_prune)
 
-def generate_compile_commands(last_steps : list[BuildStep], output : Path, directory : Path):
+
+def _write_if_changed(path : Path, chunks : Iterable[str]) -> bool:
+    """
+    Write given text into file, if its contents differ.
+    Unchanged files are not touched, so their mtime stays the same.
+    Chunks are written into temporary file as they come, so whole
+    text is never kept in memory. Returns `True` if file was written.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + '.tmp')
+    with open(tmp, 'w') as f:
+        for i in chunks:
+            f.write(i)
+
+    try:
+        if filecmp.cmp(tmp, path, shallow=False):
+            tmp.unlink()
+            return False
+    except OSError:
+        pass # No such file, will create it
+    tmp.replace(path)
+    return True
+
+
+def _compile_commands_chunks(entries : Iterable[dict]) -> Iterator[str]:
+    """Serialize entries into `compile_commands.json` text chunks, one per entry"""
+    first = True
+    for entry in entries:
+        yield ('[\n  ' if first else ',\n  ') + json.dumps(entry)
+        first = False
+    yield '[]\n' if first else '\n]\n'
+
+
+def generate_compile_commands(last_steps : list[BuildStep], output : Path, directory : Path,
+                              per_directory : bool = False) -> bool:
     """
     Generate `compile_commands.json` file, used by tools such as `clangd`
     to determine how file will be compiled. 
@@ -153,11 +348,19 @@ def generate_compile_commands(last_steps : list[BuildStep], output : Path, direc
     Only `BuildExecStep`-s are written. For them to be written they must
     have one input file (property `input_files`).
 
+    File is written only if its contents changed, so tools watching
+    it do not reindex the project on every build. One entry is
+    written per line.
+
+    If `per_directory` is set, additionally writes file with
+    `output`'s name and entries of that directory into each
+    source directory, so huge projects can be indexed by parts.
+
+    Returns `True` if any file was written.
     """
-    res = []
+    steps : list[ExecBuildStep] = []
 
     def generate(step : BuildStep):
-        nonlocal file
 
         if not isinstance(step, ExecBuildStep):
             return # Cannot put non-command step into compile COMMANDS
@@ -165,14 +368,26 @@ def generate_compile_commands(last_steps : list[BuildStep], output : Path, direc
         if len(step.input_files) != 1:
             return # Compile commands requires one file transformations.
 
-        res.append({
-            'directory': str(directory),
-            'file': str(step.input_files[0]),
-            'arguments': [step.command, *map(str, step.args)]
-        })
+        steps.append(step)
 
     walk_deps(last_steps, generate) 
 
-    with open(output, 'w') as file:
-        json.dump(res, file, indent=2)
-
+    # Entries are made while they are written, only steps are kept
+    def entries(steps : list[ExecBuildStep]) -> Iterator[dict]:
+        for step in steps:
+            yield {
+                'directory': str(directory),
+                'file': str(step.input_files[0]),
+                'arguments': [step.command, *map(str, step.args)]
+            }
+
+    written = _write_if_changed(Path(output), _compile_commands_chunks(entries(steps)))
+
+    if per_directory:
+        shards : dict[Path, list[ExecBuildStep]] = {}
+        for step in steps:
+            shards.setdefault(Path(step.input_files[0]).parent, []).append(step)
+        for folder, shard in shards.items():
+            written = _write_if_changed(folder / Path(output).name, _compile_commands_chunks(entries(shard))) or written
+
+    return written
@@ -0,0 +1,352 @@
+"""
+Executors run commands of `ExecBuildStep`-s. By default commands
+are run as local subprocesses, but they can also be sent to
+worker servers (see `pysbs.misc.worker`) on other machines.
+"""
+
+__all__ = ['ExecResult', 'ResourceUsage', 'Executor', 'LocalExecutor', 'RemoteExecutor', 'run_process', 'use_executor', 'get_executor', 'TOKEN_ENV']
+
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import os
+import signal
+import subprocess
+import threading
+
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Optional
+
+from pysbs.core import metrics
+
+if TYPE_CHECKING:
+    from pysbs.misc.exec_step import ExecBuildStep
+
+
+@dataclass
+class ResourceUsage:
+    """
+    Resources used by a command and its children,
+    as reported by the kernel when it exited.
+    """
+
+    user_time : float
+    """CPU time spent in user mode, in seconds"""
+
+    system_time : float
+    """CPU time spent in kernel, in seconds"""
+
+    max_rss : int
+    """Peak resident memory, in kilobytes"""
+
+    read_blocks : int
+    """Number of blocks read from file systems"""
+
+    write_blocks : int
+    """Number of blocks written to file systems"""
+
+    @staticmethod
+    def from_rusage(ru) -> 'ResourceUsage':
+        return ResourceUsage(ru.ru_utime, ru.ru_stime, ru.ru_maxrss, ru.ru_inblock, ru.ru_oublock)
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+@dataclass
+class ExecResult:
+    """
+    Result of running a command.
+    """
+
+    returncode : int
+    """Exit code of the command"""
+
+    output : bytes
+    """What command printed to stdout and stderr"""
+
+    usage : Optional[ResourceUsage] = None
+    """Resources command used, if they are known"""
+
+
+def _wait(process : subprocess.Popen, on_output : Optional[Callable[[bytes], None]] = None) -> ExecResult:
+    if on_output is None:
+        output = process.stdout.read()
+    else:
+        lines = []
+        for line in process.stdout:
+            lines.append(line)
+            on_output(line)
+        output = b''.join(lines)
+    process.stdout.close()
+    # Unlike `wait()`, `wait4()` also gives resource usage
+    _, status, ru = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return ExecResult(process.returncode, output, ResourceUsage.from_rusage(ru))
+
+
+async def run_process(command : str, args : list[str], cwd : Optional[os.PathLike] = None,
+                      env : Optional[dict[str, str]] = None,
+                      on_output : Optional[Callable[[bytes], None]] = None) -> ExecResult:
+    """
+    Run command, collecting its output and resource usage. Command
+    and its children are killed, if this coroutine is cancelled.
+    `env` is added to environment of this process. If `on_output`
+    is given, it is called with each line of output as it comes.
+    """
+    metrics.count('subprocesses')
+    process = subprocess.Popen(
+            [command, *args], cwd=cwd, env={ **os.environ, **env } if env else None,
+            stdout = subprocess.PIPE, stderr = subprocess.STDOUT,
+            start_new_session = True
+    )
+
+    # Process is waited for in a thread, as asyncio
+    # cannot tell resource usage of processes
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def set_result(result : ExecResult):
+        if not future.done():
+            future.set_result(result)
+
+    def set_error(ex : BaseException):
+        if not future.done():
+            future.set_exception(ex)
+
+    def output_line(line : bytes):
+        # Called in event loop thread
+        if not future.done():
+            on_output(line)
+
+    def wait():
+        try:
+            result = _wait(process, (lambda line: loop.call_soon_threadsafe(output_line, line)) if on_output else None)
+        except BaseException as ex:
+            loop.call_soon_threadsafe(set_error, ex)
+        else:
+            loop.call_soon_threadsafe(set_result, result)
+
+    threading.Thread(target=wait, daemon=True).start()
+
+    try:
+        result = await future
+    except asyncio.CancelledError:
+        # Build was stopped, do not leave process running
+        # Kill children of the command too, they keep output pipe open
+        os.killpg(process.pid, signal.SIGKILL)
+        raise
+
+    if result.usage is not None:
+        metrics.count('subprocess.cpu_time', result.usage.user_time + result.usage.system_time)
+    return result
+
+
+class Executor:
+    """
+    Something, which can run commands of `ExecBuildStep`-s.
+    """
+
+    async def execute(self, step : 'ExecBuildStep', args : list,
+                      on_output : Optional[Callable[[bytes], None]] = None) -> ExecResult:
+        """
+        Run command of given step with given arguments.
+        Arguments can be `ExecArgument`-s. Executors, which can show
+        output while command runs, pass all of it to `on_output`,
+        others only return it in the result.
+        """
+        raise NotImplementedError
+
+
+class LocalExecutor(Executor):
+    """
+    Executor, which runs commands as subprocesses on this machine.
+    """
+
+    def __init__(self, jobs : Optional[int] = None) -> None:
+        """
+        `jobs` is max number of processes run at once,
+        by default number of CPUs.
+        """
+        self.jobs = jobs or os.cpu_count() or 1
+        self._semaphore : Optional[asyncio.Semaphore] = None
+        self._loop : Optional[asyncio.AbstractEventLoop] = None
+
+    def _limit(self) -> asyncio.Semaphore:
+        # Semaphore is bound to event loop, and each `asyncio.run()` makes new one
+        if self._loop is not asyncio.get_running_loop():
+            self._loop = asyncio.get_running_loop()
+            self._semaphore = asyncio.Semaphore(self.jobs)
+        assert self._semaphore is not None
+        return self._semaphore
+
+    async def execute(self, step : 'ExecBuildStep', args : list,
+                      on_output : Optional[Callable[[bytes], None]] = None) -> ExecResult:
+        async with self._limit():
+            return await run_process(step.command, step._command_args(args), step.cwd, step.env, on_output)
+
+
+### Protocol between `RemoteExecutor` and worker
+#
+# Each message is one line of JSON. Client sends `job` message,
+# with content hashes of input files, worker answers with `need`
+# message, listing hashes it does not have. Client sends each
+# of them as `blob` message, followed by raw contents. Then worker
+# runs the command, and sends `result` message. If worker has
+# a token, `job` message must have the same one, otherwise worker
+# answers with `error` message.
+
+TOKEN_ENV = 'PYSBS_WORKER_TOKEN'
+"""Variable with token for workers, used when it is not given explicitly"""
+
+async def send_message(writer : asyncio.StreamWriter, msg : dict, data : bytes = b''):
+    writer.write(json.dumps(msg).encode() + b'\n' + data)
+    await writer.drain()
+
+async def read_message(reader : asyncio.StreamReader) -> Optional[dict]:
+    line = await reader.readline()
+    if not line:
+        return None
+    return json.loads(line)
+
+def file_hash(data : bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class _WorkerSlot:
+    """Worker server, known to `RemoteExecutor`"""
+
+    def __init__(self, address : str, jobs : int) -> None:
+        host, port = address.rsplit(':', 1)
+        self.host = host
+        self.port = int(port)
+        self.jobs = jobs
+        self.running = 0
+
+
+class RemoteExecutor(Executor):
+    """
+    Executor, which sends commands to worker servers (`pysbs.misc.worker`).
+
+    Input files are sent by content hash, so files worker already has
+    are not uploaded again. Paths are recreated on the worker as they
+    are on this machine, so the same compiler must be installed there.
+
+    When all workers are busy or unreachable, or step does not allow
+    remote execution, command is run by `fallback` executor.
+
+    Worker writes only files listed as outputs of the step, others
+    sent back are refused.
+    """
+
+    def __init__(self, workers : list[str], jobs_per_worker : int = 1, fallback : Optional[Executor] = None,
+                 token : Optional[str] = None) -> None:
+        """
+        `workers` are addresses in `host:port` form. `token` is sent
+        to workers started with it, by default it is taken from
+        `TOKEN_ENV` variable.
+        """
+        self.workers = [ _WorkerSlot(i, jobs_per_worker) for i in workers ]
+        self.fallback = fallback or LocalExecutor()
+        self.token = token if token is not None else os.environ.get(TOKEN_ENV)
+        # (path, mtime, size) -> content hash
+        self._hashes : dict[tuple[str, float, int], str] = {}
+
+    def _take_worker(self) -> Optional[_WorkerSlot]:
+        free = [ i for i in self.workers if i.running < i.jobs ]
+        if not free:
+            return None
+        worker = min(free, key=lambda i: i.running)
+        worker.running += 1
+        return worker
+
+    def _hash(self, path : str) -> str:
+        st = os.stat(path)
+        key = (path, st.st_mtime, st.st_size)
+        if key not in self._hashes:
+            self._hashes[key] = file_hash(Path(path).read_bytes())
+        return self._hashes[key]
+
+    async def execute(self, step : 'ExecBuildStep', args : list,
+                      on_output : Optional[Callable[[bytes], None]] = None) -> ExecResult:
+        if not step.remote_allowed:
+            return await self.fallback.execute(step, args, on_output)
+
+        worker = self._take_worker()
+        if worker is None:
+            return await self.fallback.execute(step, args, on_output)
+
+        try:
+            # Output of remote commands is returned when they finish
+            return await self._execute_on(worker, step, args)
+        except (OSError, asyncio.IncompleteReadError, ValueError) as ex:
+            logging.warning(f'Worker {worker.host}:{worker.port} failed ({ex}), running locally')
+            return await self.fallback.execute(step, args, on_output)
+        finally:
+            worker.running -= 1
+
+    async def _execute_on(self, worker : _WorkerSlot, step : 'ExecBuildStep', args : list) -> ExecResult:
+        inputs = { os.path.abspath(i): self._hash(os.path.abspath(i)) for i in step.remote_input_files }
+        outputs = [ os.path.abspath(i) for i in step.output_files ]
+
+        reader, writer = await asyncio.open_connection(worker.host, worker.port)
+        try:
+            await send_message(writer, {
+                'type': 'job',
+                'command': step.command,
+                'args': [ [str(i), getattr(i, 'fmt', None)] for i in args ],
+                'cwd': os.path.abspath(step.cwd or os.getcwd()),
+                'env': step.env or {},
+                'inputs': inputs,
+                'outputs': outputs,
+                'token': self.token
+            })
+
+            need = await read_message(reader)
+            if need is not None and need['type'] == 'error':
+                raise ValueError(f'Worker refused job: {need["message"]}')
+            if need is None or need['type'] != 'need':
+                raise ValueError('Unexpected answer from worker')
+
+            metrics.count('remote.jobs')
+            by_hash = { h: path for path, h in inputs.items() }
+            for h in need['hashes']:
+                data = Path(by_hash[h]).read_bytes()
+                metrics.count('remote.uploaded_bytes', len(data))
+                await send_message(writer, { 'type': 'blob', 'hash': h, 'size': len(data) }, data)
+
+            result = await read_message(reader)
+            if result is None or result['type'] != 'result':
+                raise ValueError('Unexpected answer from worker')
+        finally:
+            writer.close()
+
+        # Worker must not write anything else on this machine
+        unexpected = set(result['outputs']) - set(outputs)
+        if unexpected:
+            raise ValueError(f'Worker sent files which are not outputs of the step: {", ".join(sorted(unexpected))}')
+
+        for path, file in result['outputs'].items():
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            Path(path).write_bytes(base64.b64decode(file['data']))
+            os.chmod(path, file['mode'])
+
+        usage = ResourceUsage(**result['usage']) if result.get('usage') else None
+        return ExecResult(result['returncode'], base64.b64decode(result['output']), usage)
+
+
+# Executor used by `ExecBuildStep`-s
+executor : Executor = LocalExecutor()
+
+def use_executor(new : Executor):
+    """
+    Use given executor to run commands of all `ExecBuildStep`-s.
+    """
+    global executor
+    executor = new
+
+def get_executor() -> Executor:
+    return executor
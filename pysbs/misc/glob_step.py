@@ -0,0 +1,224 @@
+"""
+Finding source files by glob patterns, without walking the whole tree
+on every run.
+
+Listings of all folders under searched folder are stored in the database
+(as one record) together with their mtimes. Mtime of a folder changes when
+files are added to it, removed or renamed, so on next runs only folders
+with changed mtime are listed again, others are only checked with `stat()`.
+
+    sources = GlobStep(SRC_FOLDER, '**/*.c')
+    compilation_steps = [ CAutoCompilationStep(project, i, BUILD_FOLDER) for i in sources.files ]
+    linking_step = CLinkingStep(project, compilation_steps, OUT_FILE, dependencies=[sources])
+
+`GlobStep` changes when list of found files changes, so steps depending
+on it are rebuilt when files are added or removed.
+"""
+
+__all__ = ['GlobStep', 'glob_files']
+
+from hashlib import sha1
+from pathlib import Path
+from typing import Optional
+import os
+import re
+
+from pysbs.core import gc, metrics
+from pysbs.core.config import get_database
+from pysbs.core.step import BuildStep
+
+class _Tree:
+    """Listings of folders under one searched folder"""
+
+    def __init__(self, root : str):
+        self.root = root
+        self.ns = get_database().get_ns('globs')
+        # Folder -> [mtime, files, folders], as stored in the database
+        self.stored : dict[str, list] = self.ns.get(root, {})
+        # Folders checked in this run of build script
+        self.checked : set[str] = set()
+        self.changed = False
+
+    def listing(self, folder : str) -> tuple[list[str], list[str]]:
+        """Get names of files and subfolders of given folder"""
+        if folder not in self.checked:
+            self.checked.add(folder)
+            self._check(folder)
+        return self.stored[folder][1], self.stored[folder][2]
+
+    def _check(self, folder : str):
+        metrics.count('stat')
+        try:
+            mtime = os.stat(folder).st_mtime_ns
+        except OSError:
+            self._forget(folder)
+            self.stored[folder] = [None, [], []]
+            return
+
+        cached = self.stored.get(folder)
+        if cached is not None and cached[0] == mtime:
+            metrics.count('glob.cached_folders')
+            return
+
+        metrics.count('glob.listed_folders')
+        files, folders = [], []
+        with os.scandir(folder) as it:
+            for entry in it:
+                # Symlinks to folders are not followed, like `Path.glob()` does
+                if entry.is_dir(follow_symlinks=False):
+                    folders.append(entry.name)
+                else:
+                    files.append(entry.name)
+        files.sort()
+        folders.sort()
+
+        if cached is not None:
+            for name in set(cached[2]) - set(folders):
+                self._forget(os.path.join(folder, name))
+        self.stored[folder] = [mtime, files, folders]
+        self.changed = True
+
+    def _forget(self, folder : str):
+        """Remove listings of folder which is not there anymore"""
+        for i in [ i for i in self.stored if i == folder or i.startswith(folder + os.sep) ]:
+            del self.stored[i]
+            self.changed = True
+
+    def save(self):
+        if self.changed:
+            self.ns[self.root] = self.stored
+            self.changed = False
+
+
+# Searched folder -> its listings, for this run of build script
+_trees : dict[str, _Tree] = {}
+
+
+def reset():
+    """Forget folder listings of this run, so they are checked again"""
+    _trees.clear()
+
+
+def _prune() -> int:
+    # Listings of searched folders, which were removed
+    ns = get_database().get_ns('globs')
+    stale = gc.stale_keys(ns)
+    for i in stale:
+        del ns[i]
+        _trees.pop(i, None)
+    return len(stale)
+
+gc.add_pruner(_prune)
+
+
+def _compile_pattern(pattern : str) -> re.Pattern:
+    """Make regex matching relative paths (with `/`) for glob pattern"""
+    result = ''
+    for part in pattern.split('/'):
+        if part == '**':
+            result += '(?:[^/]+/)*'
+            continue
+        for char in part:
+            if char == '*':
+                result += '[^/]*'
+            elif char == '?':
+                result += '[^/]'
+            else:
+                result += re.escape(char)
+        result += '/'
+    return re.compile(result[:-1] if result.endswith('/') else result + '[^/]+')
+
+
+def glob_files(folder : Path, pattern : str) -> list[Path]:
+    """
+    Find files in `folder` matching `pattern`, like `folder.glob(pattern)`,
+    (`*`, `?` and `**` for any number of folders are supported), but using
+    listings stored in the database. Result is sorted.
+    """
+    with metrics.timer('glob'):
+        regex = _compile_pattern(pattern)
+        parts = pattern.split('/')
+        # Without `**` folders deeper than the pattern are not needed
+        max_depth = None if '**' in parts else len(parts) - 1
+
+        root = str(folder)
+        if root not in _trees:
+            _trees[root] = _Tree(root)
+        tree = _trees[root]
+
+        result = []
+
+        def visit(path : str, prefix : str, depth : int):
+            files, folders = tree.listing(path)
+            for name in files:
+                if regex.fullmatch(prefix + name):
+                    result.append(os.path.join(path, name))
+            if max_depth is not None and depth >= max_depth:
+                return
+            for name in folders:
+                visit(os.path.join(path, name), prefix + name + '/', depth + 1)
+
+        visit(root, '', 0)
+        tree.save()
+        # Sorted like paths, not strings
+        result.sort(key=lambda i: i.split(os.sep))
+        return [ Path(i) for i in result ]
+
+
+class GlobStep(BuildStep):
+    """
+    Step for files in `folder` matching `pattern`. Its input version
+    changes when list of found files changes, so steps which depend
+    on it are rebuilt when files are added or removed.
+    """
+
+    def __init__(self, folder : Path, pattern : str):
+        super().__init__()
+        self.folder = Path(folder)
+        self.pattern = pattern
+        self.name = f'Glob {self.folder / pattern}'
+        self._files : Optional[list[Path]] = None
+
+    def __getstate__(self):
+        # Files are found again after graph is loaded
+        state = super().__getstate__()
+        state['_files'] = None
+        return state
+
+    @property
+    def files(self) -> list[Path]:
+        """Found files, sorted"""
+        if self._files is None:
+            self._files = glob_files(self.folder, self.pattern)
+        return self._files
+
+    @property
+    def dependency_files(self) -> list[Path]:
+        # Files added to folder affect it too
+        return [self.folder]
+
+    @property
+    def graph_version(self) -> Optional[str]:
+        # Steps for found files are made by build script
+        return self.input_version
+
+    @property
+    def step_id(self) -> str:
+        return f'GlobStep {{ {self.folder} {self.pattern} }}'
+
+    @property
+    def input_version(self) -> str:
+        return sha1('\n'.join(map(str, self.files)).encode()).hexdigest()[:16]
+
+    def explain_input_change(self, old : str, new : str) -> list[str]:
+        stored = self.ns.get('files')
+        if stored is None:
+            return super().explain_input_change(old, new)
+        current = set(map(str, self.files))
+        return [
+            *[ f'{i} was added' for i in sorted(current - set(stored)) ],
+            *[ f'{i} was removed' for i in sorted(set(stored) - current) ]
+        ]
+
+    async def run(self):
+        self.ns['files'] = list(map(str, self.files))
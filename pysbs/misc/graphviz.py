@@ -1,41 +1,163 @@
 from collections.abc import Callable
+from hashlib import sha1
+from io import StringIO
+from typing import Optional, TextIO
+import json
+import logging
 
-from alive_progress.core.hook_manager import logging
 from pysbs.core.step import BuildStep
 from pysbs.misc.walk import walk_deps
 
-def ghash(v):
-    return 'n_' + str(hash(v)).replace('-', 'm')
+def ghash(v : str):
+    """
+    Name of DOT node for given step id.
+    Unlike `hash()` it is same between runs, so graphs can be diffed.
+    """
+    return 'n_' + sha1(v.encode()).hexdigest()[:16]
 
-def make_dot_graph(top_steps : list[BuildStep],
-                   fmt : Callable[[BuildStep], str] = lambda v : v.step_id,
-                   extra_graph_data : str = '',
-                   extra_note_attrs : Callable[[BuildStep], list[str]] = lambda _ : []):
+def _dot_str(v : str):
+    """Quote string for use in DOT file"""
+    return '"' + v.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def select_steps(top_steps : list[BuildStep],
+                 reachable_from : Optional[BuildStep] = None,
+                 leading_to : Optional[BuildStep] = None) -> list[BuildStep]:
     """
-    Generate graph of step dependencies in DOT format to be
-    rendered by graphviz
+    List steps given steps depend on (dependencies first).
+
+    If `reachable_from` is given, only that step and steps it depends on
+    are listed. If `leading_to` is given, only that step and steps which
+    depend on it are listed.
+    """
+
+    steps = []
+    walk_deps([reachable_from] if reachable_from else top_steps, steps.append)
+
+    if leading_to is not None:
+        # Dependencies go first, so we need only one pass
+        leading = { leading_to.step_id }
+        for i in steps:
+            if any(dep.step_id in leading for dep in i.dependencies):
+                leading.add(i.step_id)
+        steps = [ i for i in steps if i.step_id in leading ]
+
+    return steps
+
+
+def _graph_edges(steps : list[BuildStep], collapse_chains : bool) -> tuple[list[BuildStep], dict[str, list[BuildStep]]]:
+    """
+    Make list of nodes and dependencies of each node, maybe collapsing
+    chains (like `a.h` includes `b.h` includes `c.h`) into one edge.
+    """
+
+    selected = { i.step_id for i in steps }
+    dependents : dict[str, int] = {}
+    for i in steps:
+        for dep in i.dependencies:
+            dependents[dep.step_id] = dependents.get(dep.step_id, 0) + 1
+
+    def selected_deps(step : BuildStep):
+        return [ i for i in step.dependencies if i.step_id in selected ]
+
+    collapsed = set()
+    if collapse_chains:
+        for i in steps:
+            if dependents.get(i.step_id, 0) == 1 and len(selected_deps(i)) == 1:
+                collapsed.add(i.step_id)
+
+    nodes = [ i for i in steps if i.step_id not in collapsed ]
+    edges = {}
+    for i in nodes:
+        deps = []
+        for dep in selected_deps(i):
+            while dep.step_id in collapsed:
+                dep = selected_deps(dep)[0]
+            if dep not in deps:
+                deps.append(dep)
+        edges[i.step_id] = deps
+
+    return nodes, edges
+
+
+def write_dot_graph(top_steps : list[BuildStep],
+                    file : TextIO,
+                    fmt : Callable[[BuildStep], str] = lambda v : v.step_id,
+                    extra_graph_data : str = '',
+                    extra_note_attrs : Callable[[BuildStep], list[str]] = lambda _ : [],
+                    reachable_from : Optional[BuildStep] = None,
+                    leading_to : Optional[BuildStep] = None,
+                    collapse_chains : bool = False):
+    """
+    Write graph of step dependencies in DOT format to be
+    rendered by graphviz into given file.
 
     fmt takes step, should return label to show.
+
+    `reachable_from` and `leading_to` limit graph to a part of it,
+    see `select_steps()`. If `collapse_chains` is set, steps with
+    only one dependency and one dependent are not shown.
     """
 
-    result = ""
+    nodes, edges = _graph_edges(select_steps(top_steps, reachable_from, leading_to), collapse_chains)
 
-    def add_step(s : BuildStep):
-        nonlocal result
+    file.write("digraph build_tree {\n") #}
+    file.write(extra_graph_data + '\n')
 
+    for s in nodes:
         logging.debug(f'Generating DOT node for {s.step_id}')
 
-        params = [f'label="{fmt(s)}"', *extra_note_attrs(s)]
-        result += f'  {ghash(s.step_id)} [{', '.join(params)}];\n'
+        params = ', '.join([f'label={_dot_str(fmt(s))}', *extra_note_attrs(s)])
+        file.write(f'  {ghash(s.step_id)} [{params}];\n')
+
+        for i in edges[s.step_id]:
+            file.write(f'  {ghash(i.step_id)} -> {ghash(s.step_id)};\n')
+
+    file.write("}\n")
+
+
+def write_json_graph(top_steps : list[BuildStep],
+                     file : TextIO,
+                     fmt : Callable[[BuildStep], str] = lambda v : v.name,
+                     reachable_from : Optional[BuildStep] = None,
+                     leading_to : Optional[BuildStep] = None,
+                     collapse_chains : bool = False):
+    """
+    Write graph of step dependencies as compact JSON for other tools.
+    It is an object with `steps` list, containing `id`, `label`
+    and `deps` (indices of dependencies in `steps`) of each step.
+    Dependencies go before steps depending on them.
+
+    Other parameters are same as in `write_dot_graph()`.
+    """
+
+    nodes, edges = _graph_edges(select_steps(top_steps, reachable_from, leading_to), collapse_chains)
+    index = { s.step_id: n for n, s in enumerate(nodes) }
 
-        for i in s.dependencies:
-            result += f'  {ghash(i.step_id)} -> {ghash(s.step_id)};\n'
+    file.write('{"steps":[\n')
+    for n, s in enumerate(nodes):
+        file.write(json.dumps({
+            'id': s.step_id,
+            'label': fmt(s),
+            'deps': [ index[i.step_id] for i in edges[s.step_id] ]
+        }, separators=(',', ':')))
+        file.write(',\n' if n + 1 != len(nodes) else '\n')
+    file.write(']}\n')
 
-    result += "digraph build_tree {\n" #}
-    result += extra_graph_data + '\n'
 
-    walk_deps(top_steps, add_step)
+def make_dot_graph(top_steps : list[BuildStep],
+                   fmt : Callable[[BuildStep], str] = lambda v : v.step_id,
+                   extra_graph_data : str = '',
+                   extra_note_attrs : Callable[[BuildStep], list[str]] = lambda _ : [],
+                   **kwargs):
+    """
+    Generate graph of step dependencies in DOT format to be
+    rendered by graphviz. Returns string, for big graphs
+    use `write_dot_graph()`.
 
-    result += "}\n"
+    fmt takes step, should return label to show.
+    """
 
-    return result
+    result = StringIO()
+    write_dot_graph(top_steps, result, fmt, extra_graph_data, extra_note_attrs, **kwargs)
+    return result.getvalue()
@@ -4,6 +4,8 @@ In this file we check if the build script changed.
 
 from collections.abc import Callable
 from dataclasses import dataclass
+from hashlib import sha1
+import json
 import os
 import re
 import sys
@@ -14,6 +16,7 @@ from typing import Optional
 import logging
 
 from pysbs.core.config import get_database
+from pysbs.core import metrics
 from .include_finder import find_includes, ExcludedZoneSpec
 
 
@@ -145,7 +148,21 @@ def walk_deptree(tree : DeptreeFile, callable : Callable[[DeptreeFile], None]):
     fn(tree)
 
 
-def invalidate_if_needed(script : Path, project_bounds : Path):
+def invalidate_if_needed(script : Path, project_bounds : Path) -> str:
+    """
+    Drop records of all steps, if build script or files it imports
+    (from `project_bounds` folder) changed. Returns fingerprint of the
+    build script, which changes when any of that files change.
+    """
+    with metrics.timer('invalidate'):
+        return _invalidate_if_needed(script, project_bounds)
+
+def _fingerprint(tree : DeptreeFile) -> str:
+    files = []
+    walk_deptree(tree, lambda file: files.append([str(file.path), os.path.getmtime(file.path)]))
+    return sha1(json.dumps(sorted(files)).encode()).hexdigest()
+
+def _invalidate_if_needed(script : Path, project_bounds : Path) -> str:
 
     ns = get_database().get_ns('invalidator')
 
@@ -157,6 +174,7 @@ def invalidate_if_needed(script : Path, project_bounds : Path):
     def check_changed(file : DeptreeFile):
         nonlocal changed
         old = ns.get(str(file.path), -1)
+        metrics.count('stat')
         cur = os.path.getmtime(file.path)
 
         if old != cur:
@@ -176,7 +194,7 @@ def invalidate_if_needed(script : Path, project_bounds : Path):
         pass
 
     if not changed:
-        return
+        return _fingerprint(tree)
 
     get_database().get_ns('steps').drop()
 
@@ -184,4 +202,5 @@ def invalidate_if_needed(script : Path, project_bounds : Path):
         ns[str(file.path)] = os.path.getmtime(file.path)
 
     walk_deptree(tree, update_versions)
+    return _fingerprint(tree)
 
@@ -0,0 +1,123 @@
+"""
+Saving constructed graph of steps, so next run of unchanged build
+script loads it instead of creating all steps again.
+
+    fingerprint = invalidate_if_needed(THIS_FILE, PYSBS_DIR)
+    sources = sorted(SRC_FOLDER.glob('**/*.c'))
+
+    def make_graph():
+        ...
+        return linking_step
+
+    linking_step = cached_graph(fingerprint, make_graph, key=sources)
+
+Snapshot is used only when the build script fingerprint (from
+`invalidate_if_needed()`) and `key` are the same as when it was saved.
+So `key` must contain everything else graph is made from, like list
+of sources found by `Path.glob()` (`GlobStep` from `pysbs.misc.glob_step`
+does not need that, it is checked as other steps). Steps, `graph_version` of which changed
+(like includes of some file), find their dependencies again.
+"""
+
+__all__ = ['cached_graph', 'load_graph', 'save_graph']
+
+from pathlib import Path
+from typing import Any, Callable, Optional, TypeVar
+import logging
+import pickle
+
+from pysbs.core import config, metrics
+from pysbs.core.step import BuildStep
+
+T = TypeVar('T')
+
+SNAPSHOT_SUFFIX = '.graph'
+"""Snapshot is stored near the database, with this added to its name"""
+
+
+def _snapshot_path() -> Path:
+    if config.dbpath is None:
+        raise RuntimeError("Database file was not opened! Use `use_database()` to that")
+    return config.dbpath.parent / (config.dbpath.name + SNAPSHOT_SUFFIX)
+
+
+def _step_classes(cls : type = BuildStep) -> list[type]:
+    result = [cls]
+    for i in cls.__subclasses__():
+        result += _step_classes(i)
+    return result
+
+
+def save_graph(fingerprint : str, graph : Any, key : Any = None):
+    """
+    Save all steps created so far, and `graph` (anything picklable,
+    like target steps), to be loaded by `load_graph()`.
+    """
+    with metrics.timer('snapshot'):
+        steps = { i.step_id: i for cls in _step_classes() for i in cls.by_id.values() }
+        snapshot = {
+            'fingerprint': fingerprint,
+            'key': key,
+            'versions': { step_id: i.graph_version for step_id, i in steps.items() if i.graph_version is not None },
+            'steps': steps,
+            'graph': graph
+        }
+        tmp = _snapshot_path().with_suffix('.tmp')
+        with open(tmp, 'wb') as f:
+            pickle.dump(snapshot, f, pickle.HIGHEST_PROTOCOL)
+        tmp.replace(_snapshot_path())
+
+
+def load_graph(fingerprint : str, key : Any = None) -> Optional[Any]:
+    """
+    Load graph saved by `save_graph()`, if it is still valid.
+    Steps of it are registered, as if they were created.
+    Returns `None` if there is no valid snapshot.
+    """
+    with metrics.timer('snapshot'):
+        try:
+            with open(_snapshot_path(), 'rb') as f:
+                snapshot = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as ex:
+            # Like classes of steps changed
+            logging.debug(f'Graph snapshot is not loaded: {ex}')
+            return None
+
+        if snapshot['fingerprint'] != fingerprint or snapshot['key'] != key:
+            return None
+
+        steps : dict[str, BuildStep] = snapshot['steps']
+        outdated = [
+            steps[step_id] for step_id, version in snapshot['versions'].items()
+            if steps[step_id].graph_version != version
+        ]
+
+        for step_id, step in steps.items():
+            type(step).by_id[step_id] = step
+        metrics.count('snapshot.loaded_steps', len(steps))
+
+        for step in outdated:
+            metrics.count('snapshot.refreshed_steps')
+            if not step.refresh_graph():
+                for step_id, i in steps.items():
+                    del type(i).by_id[step_id]
+                return None
+
+        if outdated:
+            # Save found dependencies, so they are not found again next time
+            save_graph(fingerprint, snapshot['graph'], key)
+        return snapshot['graph']
+
+
+def cached_graph(fingerprint : str, make : Callable[[], T], key : Any = None) -> T:
+    """
+    Load graph from snapshot, or make it by calling `make()`,
+    and save snapshot of it.
+    """
+    graph = load_graph(fingerprint, key)
+    if graph is None:
+        graph = make()
+        save_graph(fingerprint, graph, key)
+    return graph
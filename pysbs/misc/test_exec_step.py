@@ -0,0 +1,62 @@
+import asyncio
+import json
+import os
+
+from conftest import forget_steps, run_build
+from pysbs.core import gc
+from pysbs.core.config import get_database
+from pysbs.misc.exec_step import RESPONSE_FILE_DIR, ExecBuildStep, generate_compile_commands
+
+
+class Echo(ExecBuildStep):
+    """Step which always passes arguments in response file"""
+
+    response_file_threshold = 0
+
+
+def test_response_files_of_other_commands_are_removed(database):
+    step = Echo('echo', args=['main'])
+    assert run_build(step)
+    assert asyncio.run(step.execute(['other']))
+    assert [ i.name for i in (database / RESPONSE_FILE_DIR).iterdir() ] == [step._response_file(step.args).name]
+    assert step._response_file(['other']) != step._response_file(step.args)
+
+
+def test_response_files_of_removed_steps_are_pruned(database):
+    assert run_build([Echo('echo', args=['a']), Echo('echo', args=['b'])])
+    forget_steps()
+    get_database().get_ns('steps').get_ns(Echo('echo', args=['a']).step_id).drop()
+
+    assert gc.prune() >= 1
+    assert [ i.name for i in (database / RESPONSE_FILE_DIR).iterdir() ] == [Echo('echo', args=['b'])._response_file(['b']).name]
+
+
+class Compile(ExecBuildStep):
+
+    def __init__(self, input, dependencies=[]):
+        super().__init__('cc', dependencies, ['-c', input])
+        self.input = input
+
+    @property
+    def input_files(self):
+        return [self.input]
+
+
+def test_compile_commands_are_rewritten_only_when_changed(database):
+    (database / 'src').mkdir()
+    (database / 'lib').mkdir()
+    steps = [ Compile(database / 'src' / 'a.c'), Compile(database / 'lib' / 'b.c') ]
+    output = database / 'compile_commands.json'
+
+    assert generate_compile_commands(steps, output, database, per_directory=True)
+    entries = json.loads(output.read_text())
+    assert [ i['file'] for i in entries ] == [ str(i.input) for i in steps ]
+    assert len(json.loads((database / 'src' / 'compile_commands.json').read_text())) == 1
+
+    os.utime(output, (1, 1))
+    assert not generate_compile_commands(steps, output, database, per_directory=True)
+    assert output.stat().st_mtime == 1
+    assert [ i.name for i in (database / 'src').iterdir() ] == ['compile_commands.json']
+
+    assert generate_compile_commands([], output, database)
+    assert output.read_text() == '[]\n'
@@ -0,0 +1,19 @@
+from pathlib import Path
+import os
+
+from conftest import run_build
+from pysbs.misc.testing import DEFAULT_SHARDS, sharded_tests
+
+
+def test_shards_run_relative_binary_in_other_folder(database, monkeypatch):
+    binary = database / 'tests.sh'
+    binary.write_text('#!/bin/sh\necho "$TEST_SHARD_INDEX" >> shards.txt\n')
+    binary.chmod(0o755)
+    (database / 'data').mkdir()
+    monkeypatch.chdir(database)
+    monkeypatch.setattr(os, 'cpu_count', lambda: 64)
+
+    tests = sharded_tests(Path('tests.sh'), cwd=database / 'data')
+    assert len(tests) == DEFAULT_SHARDS
+    assert run_build(tests)
+    assert sorted((database / 'data' / 'shards.txt').read_text().split()) == list(map(str, range(DEFAULT_SHARDS)))
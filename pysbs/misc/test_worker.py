@@ -0,0 +1,36 @@
+import asyncio
+import os
+
+from pysbs.misc.executor import file_hash, read_message, send_message
+from pysbs.misc.worker import Worker
+
+
+def test_job_with_path_as_hash_is_refused(tmp_path):
+    (tmp_path / 'secret').write_text('secret')
+    worker = Worker(tmp_path / 'cache')
+
+    async def send_job():
+        server = await asyncio.start_server(worker.handle, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            await send_message(writer, { 'type': 'job', 'inputs': { 'a.c': '../../secret' } })
+            reply = await read_message(reader)
+            writer.close()
+            return reply
+
+    assert asyncio.run(send_job()) == { 'type': 'error', 'message': 'invalid hash' }
+
+
+def test_least_recently_used_blobs_are_removed(tmp_path):
+    worker = Worker(tmp_path, max_cache=20)
+    blobs = [ str(i).encode() * 10 for i in range(3) ]
+    for time, data in enumerate(blobs):
+        (tmp_path / 'blobs' / file_hash(data)).write_bytes(data)
+        os.utime(tmp_path / 'blobs' / file_hash(data), (time, time))
+    worker._cache_size = 30
+    worker._in_use = { file_hash(blobs[0]): 1 }
+
+    worker._trim_cache()
+    assert sorted(i.name for i in (tmp_path / 'blobs').iterdir()) == sorted([file_hash(blobs[0]), file_hash(blobs[2])])
+    assert worker._cache_size == 20
@@ -0,0 +1,185 @@
+"""
+Steps running tests.
+
+    test_binary = CLinkingStep(project, test_objects, BUILD_FOLDER / 'tests')
+    tests = sharded_tests(test_binary, shards=4, data_files=[DATA_FOLDER / 'input.txt'])
+    main({ 'app': linking_step, 'test': tests })
+
+Passed tests are not run again, until content of the binary or data files
+changes. If binary is relinked, but is the same, tests are not run either.
+Failed tests are always run again.
+"""
+
+__all__ = ['TestRunStep', 'sharded_tests', 'SHARD_INDEX_ENV', 'TOTAL_SHARDS_ENV', 'DEFAULT_SHARDS']
+
+from hashlib import sha1
+from pathlib import Path
+from typing import Optional, Union
+import json
+import os
+
+from pysbs.core import gc, metrics
+from pysbs.core.config import get_database
+from pysbs.core.step import BuildStep
+from pysbs.misc.exec_step import ExecBuildStep
+
+SHARD_INDEX_ENV = ['GTEST_SHARD_INDEX', 'TEST_SHARD_INDEX']
+"""Variables with index of shard test binary should run (GoogleTest and generic)"""
+
+TOTAL_SHARDS_ENV = ['GTEST_TOTAL_SHARDS', 'TEST_TOTAL_SHARDS']
+"""Variables with number of shards tests are split into"""
+
+DEFAULT_SHARDS = 4
+"""
+Number of shards `sharded_tests()` makes by default. It is part of
+ids of steps, so it does not depend on machine build runs on.
+"""
+
+MISSING_FILE = 'missing'
+"""Hash of file which does not exist"""
+
+# (path, mtime, size) -> content hash, for this run of build script
+_hashes : dict[tuple[str, int, int], str] = {}
+
+
+def _file_hash(path : Path) -> str:
+    """
+    Hash of file content. Hashes are stored in the database, and computed
+    again only when mtime or size of the file change.
+    """
+    metrics.count('stat')
+    try:
+        st = os.stat(path)
+    except OSError:
+        return MISSING_FILE
+
+    key = (str(path), st.st_mtime_ns, st.st_size)
+    if key in _hashes:
+        return _hashes[key]
+
+    ns = get_database().get_ns('file_hashes')
+    cached = ns.get(str(path))
+    if cached is not None and cached[:2] == [st.st_mtime_ns, st.st_size]:
+        digest = cached[2]
+    else:
+        metrics.count('tests.hashed_files')
+        hasher = sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                hasher.update(chunk)
+        digest = hasher.hexdigest()
+        ns[str(path)] = [st.st_mtime_ns, st.st_size, digest]
+
+    _hashes[key] = digest
+    return digest
+
+
+def _prune() -> int:
+    # Hashes of removed files
+    ns = get_database().get_ns('file_hashes')
+    stale = gc.stale_keys(ns)
+    for i in stale:
+        del ns[i]
+    return len(stale)
+
+gc.add_pruner(_prune)
+
+
+class TestRunStep(ExecBuildStep):
+    """
+    Step which runs test binary, and fails if it fails.
+
+    Input version is made of content hashes of the binary and `data_files`,
+    and if tests passed with the same version, they are not run again, even
+    if binary was relinked. Failed tests are always run again.
+
+    If `total_shards` is more than 1, binary runs only part of tests, given
+    by environment variables (see `SHARD_INDEX_ENV`), and other shards are
+    run by other steps, at the same time.
+    """
+
+    replay_failures = False
+
+    # Binary is the command itself, which worker runs at path of this machine
+    remote_allowed = False
+
+    # Tests do not read arguments from response files
+    response_file_threshold = None
+
+    def __init__(self, binary : Union[Path, BuildStep], args : list = [], data_files : list[Path] = [],
+                 dependencies=[], shard : int = 0, total_shards : int = 1, cwd : Optional[Path] = None) -> None:
+        """
+        `binary` can also be a step with `output` property, like `CLinkingStep`,
+        which is added to dependencies. Relative path of binary is made
+        absolute, so it is found when tests run in `cwd`.
+        """
+        dependencies = [ *dependencies, *([binary] if isinstance(binary, BuildStep) else []) ]
+        binary = os.path.abspath(binary.output if isinstance(binary, BuildStep) else binary)
+        super().__init__(str(binary), dependencies, args)
+
+        self.binary = Path(binary)
+        self.data_files = [ Path(i) for i in data_files ]
+        self.shard = shard
+        self.total_shards = total_shards
+        self.cwd = cwd
+        if total_shards > 1:
+            self.env = {
+                **{ i: str(shard) for i in SHARD_INDEX_ENV },
+                **{ i: str(total_shards) for i in TOTAL_SHARDS_ENV }
+            }
+
+        self.name = f'Test {binary}' + (f' [{shard + 1}/{total_shards}]' if total_shards > 1 else '')
+
+    @property
+    def tested_files(self) -> list[Path]:
+        """Files result of tests depends on"""
+        return [self.binary, *self.data_files]
+
+    @property
+    def dependency_files(self) -> list[Path]:
+        return self.tested_files
+
+    @property
+    def step_id(self) -> str:
+        return 'TestRunStep ' + json.dumps([
+            str(self.binary), list(map(str, self.args)), self.shard, self.total_shards,
+            str(self.cwd) if self.cwd is not None else None
+        ])
+
+    @property
+    def input_version(self) -> str:
+        return json.dumps({ str(i): _file_hash(i) for i in self.tested_files })
+
+    def explain_input_change(self, old : str, new : str) -> list[str]:
+        try:
+            old_hashes, new_hashes = json.loads(old), json.loads(new)
+        except ValueError:
+            return super().explain_input_change(old, new)
+
+        if not isinstance(old_hashes, dict):
+            return super().explain_input_change(old, new)
+
+        return [
+            f'{file} changed' for file in new_hashes
+            if old_hashes.get(file) != new_hashes[file]
+        ]
+
+    async def run(self):
+        version = self.input_version
+        if self.ns.get('passed_version') == version:
+            # Binary was relinked, but did not change
+            metrics.count('tests.cached')
+            return
+
+        metrics.count('tests.run')
+        self.ns['passed_version'] = None
+        if await self.execute(self.args):
+            self.ns['passed_version'] = version
+
+
+def sharded_tests(binary : Union[Path, BuildStep], shards : int = DEFAULT_SHARDS, **kwargs) -> list[TestRunStep]:
+    """
+    Make steps running tests of `binary` split into `shards` parts (by
+    default `DEFAULT_SHARDS`). Other arguments are passed to `TestRunStep`.
+    """
+    return [ TestRunStep(binary, shard=i, total_shards=shards, **kwargs) for i in range(shards) ]
@@ -0,0 +1,99 @@
+"""
+Reports of resources used by commands of steps: which steps
+take most CPU time, memory, or do most I/O.
+
+Usage:
+
+    python -m pysbs.misc.usage path/to/pysbs.db [--sort cpu|rss|io] [--count N]
+"""
+
+__all__ = ['UsageSummary', 'usage_summaries', 'print_usage_report']
+
+from dataclasses import dataclass
+from typing import Literal
+import argparse
+
+from pysbs.core import config
+from pysbs.core.config import get_database, _part, _unesc
+from pysbs.misc.executor import ResourceUsage
+
+SortKey = Literal['cpu', 'rss', 'io']
+
+
+@dataclass
+class UsageSummary:
+    """Resource usage of one step over its recorded runs"""
+
+    step_id : str
+
+    runs : int
+    """Number of runs usage is known for"""
+
+    last : ResourceUsage
+    """Usage on the last run"""
+
+    max_rss : int
+    """Highest peak memory of all runs, in kilobytes"""
+
+    avg_cpu_time : float
+    """Average of user and system CPU time, in seconds"""
+
+    avg_io_blocks : float
+    """Average of blocks read and written"""
+
+    def sort_value(self, key : SortKey) -> float:
+        return { 'cpu': self.avg_cpu_time, 'rss': self.max_rss, 'io': self.avg_io_blocks }[key]
+
+
+def usage_summaries() -> list[UsageSummary]:
+    """
+    Summarize usage history of all steps in current database.
+    Reads the database directly, so steps do not need to be created.
+    """
+    steps_ns = get_database().get_ns('steps')
+    prefix = steps_ns.prefix + '|'
+
+    result = []
+    for key in steps_ns.db:
+        if not key.startswith(prefix):
+            continue
+        step = _part(key, len(prefix))
+        if key[len(prefix) + len(step):] != '|usage_history':
+            continue
+        history = [ ResourceUsage(**i) for i in steps_ns.db[key] ]
+        if not history:
+            continue
+        step_id = _unesc(step)
+        result.append(UsageSummary(
+            step_id,
+            len(history),
+            history[-1],
+            max(i.max_rss for i in history),
+            sum(i.user_time + i.system_time for i in history) / len(history),
+            sum(i.read_blocks + i.write_blocks for i in history) / len(history)
+        ))
+    return result
+
+
+def print_usage_report(sort : SortKey = 'cpu', count : int = 20):
+    """Print steps which use most resources"""
+    summaries = sorted(usage_summaries(), key=lambda i: i.sort_value(sort), reverse=True)[:count]
+    if not summaries:
+        print('No resource usage recorded')
+        return
+
+    print(f'{"cpu (avg)":>10} {"rss (max)":>10} {"io (avg)":>10} {"runs":>5}  step')
+    for i in summaries:
+        print(f'{i.avg_cpu_time:9.2f}s {i.max_rss / 1024:8.1f}MiB {i.avg_io_blocks:10.0f} {i.runs:5}  {i.step_id}')
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Show steps which used most resources')
+    parser.add_argument('database')
+    parser.add_argument('--sort', choices=['cpu', 'rss', 'io'], default='cpu')
+    parser.add_argument('--count', type=int, default=20)
+    opts = parser.parse_args()
+
+    config.use_database(opts.database)
+    print_usage_report(opts.sort, opts.count)
@@ -0,0 +1,273 @@
+"""
+Worker server, which runs commands sent by `RemoteExecutor`.
+
+Usage:
+
+    python -m pysbs.misc.worker [--host HOST] [--port PORT] [--jobs N] [--cache DIR] [--max-cache MIB] [--token TOKEN]
+
+Worker runs any command it is sent, so anyone who can connect to it
+can run anything as the user of the worker. By default it listens only
+on `127.0.0.1`. To listen on other interfaces, token must be given
+(`--token` or `PYSBS_WORKER_TOKEN` variable), and clients must send the
+same one (see `RemoteExecutor`). Token is sent in plain text, so use
+workers only in trusted networks.
+
+Files are stored in cache folder by their content hash. When files take
+more than `max_cache` bytes, least recently used ones are removed. For each command
+a temporary folder is made, in which input files are placed at the same
+paths they have on the client machine. Output files are sent back.
+"""
+
+__all__ = ['Worker']
+
+import argparse
+import asyncio
+import base64
+import hmac
+import ipaddress
+import logging
+import os
+import re
+import shutil
+import tempfile
+
+from pathlib import Path
+from typing import Optional
+
+from pysbs.misc.executor import send_message, read_message, file_hash, run_process, TOKEN_ENV
+from pysbs.misc.exec_step import RESPONSE_FILE_THRESHOLD, RSP_ESCAPED_RE
+
+DEFAULT_PORT = 8719
+DEFAULT_CACHE = Path(tempfile.gettempdir()) / 'pysbs-worker'
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_MAX_CACHE = 10 * 2**30
+
+HASH_RE = re.compile(r'[0-9a-f]{64}')
+"""Content hash of file, see `file_hash()`"""
+
+
+def _is_loopback(host : str) -> bool:
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+class Worker:
+    """
+    Server, which receives jobs from `RemoteExecutor`-s and runs them.
+    """
+
+    def __init__(self, cache_dir : Path = DEFAULT_CACHE, jobs : Optional[int] = None, token : Optional[str] = None,
+                 max_cache : int = DEFAULT_MAX_CACHE) -> None:
+        """
+        If `token` is given, only jobs with the same token are run.
+        `max_cache` is size of received files (in bytes) worker keeps.
+        """
+        self.token = token
+        self.max_cache = max_cache
+        self.blobs = cache_dir / 'blobs'
+        self.sandboxes = cache_dir / 'jobs'
+        self.blobs.mkdir(parents=True, exist_ok=True)
+        self.sandboxes.mkdir(parents=True, exist_ok=True)
+        self.jobs = asyncio.Semaphore(jobs or os.cpu_count() or 1)
+        for i in self.blobs.glob('*.tmp*'):
+            # Left by worker which was stopped while receiving blob
+            i.unlink(missing_ok=True)
+        self._cache_size = sum(i.stat().st_size for i in self.blobs.iterdir())
+        # Hash -> number of jobs which need the blob, they are not removed
+        self._in_use : dict[str, int] = {}
+
+    async def serve(self, host : str = DEFAULT_HOST, port : int = DEFAULT_PORT):
+        if self.token is None and not _is_loopback(host):
+            raise ValueError(f'Worker without token can listen only on loopback address, not on {host}')
+        server = await asyncio.start_server(self.handle, host, port)
+        logging.info(f'Worker listening on {host}:{port}')
+        async with server:
+            await server.serve_forever()
+
+    async def handle(self, reader : asyncio.StreamReader, writer : asyncio.StreamWriter):
+        # One job is run per connection
+        try:
+            job = await read_message(reader)
+            if job is None or job['type'] != 'job':
+                return
+
+            if self.token is not None and not hmac.compare_digest(
+                    str(job.get('token') or '').encode(), self.token.encode()):
+                logging.warning('Received job with wrong token')
+                await send_message(writer, { 'type': 'error', 'message': 'wrong token' })
+                return
+
+            hashes = set(job['inputs'].values())
+            if not all(isinstance(h, str) and HASH_RE.fullmatch(h) for h in hashes):
+                # Hashes are names of files in cache, so they must not be paths
+                logging.warning('Received job with invalid hash')
+                await send_message(writer, { 'type': 'error', 'message': 'invalid hash' })
+                return
+
+            self._use(hashes, 1)
+            try:
+                await self._run_job_of(job, hashes, reader, writer)
+            finally:
+                self._use(hashes, -1)
+        except (OSError, asyncio.IncompleteReadError, ValueError) as ex:
+            logging.warning(f'Connection failed: {ex}')
+        finally:
+            writer.close()
+
+    def _use(self, hashes : set[str], count : int):
+        for h in hashes:
+            self._in_use[h] = self._in_use.get(h, 0) + count
+            if self._in_use[h] == 0:
+                del self._in_use[h]
+
+    async def _run_job_of(self, job : dict, hashes : set[str], reader : asyncio.StreamReader, writer : asyncio.StreamWriter):
+        missing = []
+        for h in sorted(hashes):
+            try:
+                # Blobs are removed by time they were used last
+                os.utime(self.blobs / h)
+            except FileNotFoundError:
+                missing.append(h)
+        await send_message(writer, { 'type': 'need', 'hashes': missing })
+
+        for _ in missing:
+            blob = await read_message(reader)
+            if blob is None or blob['type'] != 'blob':
+                return
+            data = await reader.readexactly(blob['size'])
+            if blob['hash'] not in missing or file_hash(data) != blob['hash']:
+                logging.error('Received blob with wrong hash')
+                return
+            # Write into temporary file first, so other jobs never see half-written blob
+            tmp = self.blobs / (blob['hash'] + '.tmp' + str(id(writer)))
+            tmp.write_bytes(data)
+            tmp.replace(self.blobs / blob['hash'])
+            self._cache_size += len(data)
+        self._trim_cache()
+
+        # Client closes connection when job is cancelled,
+        # kill the command then
+        job_task = asyncio.create_task(self._run_limited(job))
+        eof_task = asyncio.create_task(reader.read(1))
+        await asyncio.wait([job_task, eof_task], return_when=asyncio.FIRST_COMPLETED)
+        if not job_task.done():
+            job_task.cancel()
+            await asyncio.gather(job_task, return_exceptions=True)
+            return
+        eof_task.cancel()
+        await send_message(writer, job_task.result())
+
+    def _trim_cache(self):
+        """
+        Remove least recently used blobs, until cache is not bigger than
+        `max_cache`. Blobs needed by jobs being run are kept.
+        """
+        if self._cache_size <= self.max_cache:
+            return
+
+        blobs = []
+        self._cache_size = 0
+        for i in self.blobs.iterdir():
+            try:
+                stat = i.stat()
+            except FileNotFoundError:
+                continue
+            self._cache_size += stat.st_size
+            if HASH_RE.fullmatch(i.name) and i.name not in self._in_use:
+                blobs.append((stat.st_mtime, i, stat.st_size))
+
+        for _, blob, size in sorted(blobs):
+            if self._cache_size <= self.max_cache:
+                break
+            blob.unlink(missing_ok=True)
+            self._cache_size -= size
+
+    async def _run_limited(self, job : dict) -> dict:
+        async with self.jobs:
+            return await self.run_job(job)
+
+    async def run_job(self, job : dict) -> dict:
+        sandbox = Path(tempfile.mkdtemp(dir=self.sandboxes))
+
+        def local(path : str) -> Path:
+            # Absolute client path -> path in sandbox
+            return sandbox / os.path.abspath(path).lstrip('/')
+
+        try:
+            for path, h in job['inputs'].items():
+                dst = local(path)
+                dst.parent.mkdir(parents=True, exist_ok=True)
+                try:
+                    os.link(self.blobs / h, dst)
+                except OSError:
+                    shutil.copy(self.blobs / h, dst)
+
+            for path in job['outputs']:
+                local(path).parent.mkdir(parents=True, exist_ok=True)
+
+            cwd = local(job['cwd'])
+            cwd.mkdir(parents=True, exist_ok=True)
+
+            args = []
+            for value, fmt in job['args']:
+                if fmt == 'path' and os.path.isabs(value):
+                    value = str(local(value))
+                elif fmt == 'include' and os.path.isabs(value[2:]):
+                    local(value[2:]).mkdir(parents=True, exist_ok=True)
+                    value = value[:2] + str(local(value[2:]))
+                args.append(value)
+
+            if len(job['command']) + sum(len(i) + 1 for i in args) > RESPONSE_FILE_THRESHOLD:
+                rsp = sandbox / 'args.rsp'
+                rsp.write_text(''.join(RSP_ESCAPED_RE.sub(r'\\\1', i) + '\n' for i in args))
+                args = ['@' + str(rsp)]
+
+            result = await run_process(job['command'], args, cwd, job.get('env'))
+
+            # Make paths in messages point to client files
+            output = result.output.replace(str(sandbox).encode(), b'')
+
+            outputs = {}
+            for path in job['outputs']:
+                file = local(path)
+                if file.exists():
+                    outputs[path] = { 'data': base64.b64encode(file.read_bytes()).decode(), 'mode': file.stat().st_mode & 0o777 }
+
+            return {
+                'type': 'result',
+                'returncode': result.returncode,
+                'output': base64.b64encode(output).decode(),
+                'outputs': outputs,
+                'usage': result.usage.to_dict() if result.usage else None
+            }
+        except OSError as ex:
+            return {
+                'type': 'result',
+                'returncode': -1,
+                'output': base64.b64encode(f'Worker failed to run command: {ex}\n'.encode()).decode(),
+                'outputs': {}
+            }
+        finally:
+            shutil.rmtree(sandbox, ignore_errors=True)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Run commands of pysbs build steps for other machines')
+    parser.add_argument('--host', default=DEFAULT_HOST, help='Address to listen on, other than loopback one needs token')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--jobs', type=int, default=None, help='Max number of commands run at once')
+    parser.add_argument('--cache', type=Path, default=DEFAULT_CACHE, help='Folder to store received files in')
+    parser.add_argument('--max-cache', type=int, default=DEFAULT_MAX_CACHE // 2**20, help='Max size of stored files in MiB')
+    parser.add_argument('--token', default=os.environ.get(TOKEN_ENV), help=f'Token jobs must have, by default taken from {TOKEN_ENV}')
+    opts = parser.parse_args()
+
+    if opts.token is None and not _is_loopback(opts.host):
+        parser.error(f'--token (or {TOKEN_ENV}) is needed to listen on {opts.host}')
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(Worker(opts.cache, opts.jobs, opts.token, opts.max_cache * 2**20).serve(opts.host, opts.port))
@@ -0,0 +1,22 @@
+#!/bin/sh
+# Fake compiler for benchmarks. Accepts gcc-like arguments,
+# and just concatenates all input files into the output.
+# `@file` response files are supported (without quoting).
+
+out=""
+inputs=""
+
+parse() {
+    while [ $# -gt 0 ]; do
+        case "$1" in
+            -o) out="$2"; shift ;;
+            @*) parse $(cat "${1#@}") ;;
+            -*) ;;
+            *) inputs="$inputs $1" ;;
+        esac
+        shift
+    done
+}
+
+parse "$@"
+cat $inputs > "$out"
@@ -0,0 +1,133 @@
+"""
+Generator of synthetic C projects for benchmarks.
+
+Headers are placed in `depth` layers, each header includes `fanout`
+headers from the next layer, and each source includes `fanout` headers
+from the first one. Project also gets `build.py` script, which builds it
+with pysbs using fake compiler, and writes measurements into JSON file.
+
+Like other sandbox projects, project must be inside pysbs folder, so
+changes of pysbs itself invalidate the build.
+"""
+
+from pathlib import Path
+import argparse
+import random
+
+THIS_FOLDER = Path(__file__).parent
+PYSBS_DIR = THIS_FOLDER.parent.parent
+FAKE_CC = THIS_FOLDER / 'fakecc.sh'
+
+BUILD_SCRIPT = '''
+from pathlib import Path
+import sys, os, json, time, resource
+
+THIS_FILE = Path(__file__)
+THIS_FOLDER = THIS_FILE.parent
+PYSBS_DIR = Path({pysbs_dir!r})
+sys.path.append(str(PYSBS_DIR))
+##### Begin build code
+
+from pysbs.c import CProject, CLinkingStep, CAutoCompilationStep
+from pysbs.core import use_database, BuildManager, metrics
+from pysbs.misc.invalidator import invalidate_if_needed
+from pysbs.misc.snapshot import cached_graph
+from pysbs.misc.glob_step import GlobStep
+import asyncio
+
+FAKE_CC = {fake_cc!r}
+BUILD_FOLDER = THIS_FOLDER / 'build'
+BUILD_FOLDER.mkdir(parents=True, exist_ok=True)
+
+result = {{}}
+
+start = time.perf_counter()
+use_database(BUILD_FOLDER / 'pysbs.db')
+fingerprint = invalidate_if_needed(THIS_FILE, PYSBS_DIR)
+result['invalidate_time'] = time.perf_counter() - start
+
+start = time.perf_counter()
+deps_mode = os.environ.get('PYSBS_BENCH_DEPS', 'steps')
+
+def make_graph():
+    sources = GlobStep(THIS_FOLDER / 'src', '*.c')
+    project = CProject(include_paths=[THIS_FOLDER / 'include'],
+                       lazy_deps=deps_mode == 'lazy', collapsed_deps=deps_mode == 'collapsed')
+    compilation_steps = [
+        CAutoCompilationStep(project, i, BUILD_FOLDER, command=FAKE_CC)
+        for i in sources.files
+    ]
+    return CLinkingStep(project, compilation_steps, BUILD_FOLDER / 'out', dependencies=[sources], command=FAKE_CC)
+
+if os.environ.get('PYSBS_BENCH_SNAPSHOT') == '1':
+    linking_step = cached_graph(fingerprint, make_graph, key=deps_mode)
+else:
+    linking_step = make_graph()
+result['graph_time'] = time.perf_counter() - start
+
+manager = BuildManager(linking_step, jobs=int(os.environ.get('PYSBS_BENCH_JOBS', '1')))
+
+# Build checks what is dirty itself, so it is timed as one
+start = time.perf_counter()
+asyncio.run(manager.build())
+result['dirty_check_time'] = metrics.timers.get('dirty_check', 0)
+result['run_time'] = time.perf_counter() - start - result['dirty_check_time']
+result['dirty_steps'] = len(manager.to_update)
+# Lazy and collapsed modes scan while checking and building, not making the graph
+result['scan_time'] = metrics.timers.get('scan', 0)
+
+result['metrics'] = metrics.snapshot()
+result['peak_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+Path(os.environ['PYSBS_BENCH_RESULT']).write_text(json.dumps(result))
+'''
+
+
+def generate_project(root : Path, sources : int = 200, headers : int = 100,
+                     fanout : int = 3, depth : int = 4, seed : int = 0):
+    """
+    Generate project in given folder. Same parameters always
+    give same project.
+    """
+
+    rand = random.Random(seed)
+
+    (root / 'src').mkdir(parents=True, exist_ok=True)
+    (root / 'include').mkdir(parents=True, exist_ok=True)
+
+    # Split headers into layers
+    layers = [ [] for _ in range(depth) ]
+    for i in range(headers):
+        layers[i % depth].append(f'h{i}.h')
+
+    for n, layer in enumerate(layers):
+        for name in layer:
+            lines = [ '#pragma once' ]
+            if n + 1 < depth and layers[n + 1]:
+                for inc in rand.sample(layers[n + 1], min(fanout, len(layers[n + 1]))):
+                    lines.append(f'#include "{inc}"')
+            lines.append(f'int {name[:-2]}_value();')
+            (root / 'include' / name).write_text('\n'.join(lines) + '\n')
+
+    for i in range(sources):
+        lines = []
+        if layers[0]:
+            for inc in rand.sample(layers[0], min(fanout, len(layers[0]))):
+                lines.append(f'#include "{inc}"')
+        lines.append(f'int s{i}_value() {{ return {i}; }}')
+        (root / 'src' / f's{i}.c').write_text('\n'.join(lines) + '\n')
+
+    (root / 'build.py').write_text(BUILD_SCRIPT.format(pysbs_dir=str(PYSBS_DIR), fake_cc=str(FAKE_CC)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate synthetic C project')
+    parser.add_argument('root', type=Path)
+    parser.add_argument('--sources', type=int, default=200)
+    parser.add_argument('--headers', type=int, default=100)
+    parser.add_argument('--fanout', type=int, default=3)
+    parser.add_argument('--depth', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=0)
+    opts = parser.parse_args()
+
+    generate_project(opts.root, opts.sources, opts.headers, opts.fanout, opts.depth, opts.seed)
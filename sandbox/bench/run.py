@@ -0,0 +1,122 @@
+"""
+End-to-end build benchmarks on synthetic projects.
+
+Generates project (see `generate.py`), and runs its build script
+in several scenarios:
+
+ - `cold`: first build, nothing is built
+ - `null`: nothing changed
+ - `edit_source`: one source changed
+ - `edit_header`: one of the most included headers changed
+ - `edit_script`: build script changed, so everything is rebuilt
+
+Each scenario is repeated several times. Results are printed,
+and can be written to JSON file to track regressions.
+
+Usage:
+
+    python sandbox/bench/run.py [--sources N] [--headers N] [--repeat N] [--deps steps|lazy|collapsed] [--snapshot] [--output results.json]
+"""
+
+from pathlib import Path
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from generate import generate_project
+
+SCENARIOS = ['cold', 'null', 'edit_source', 'edit_header', 'edit_script']
+
+
+def touch(path : Path):
+    # Make sure mtime really changes, even on file systems with bad resolution
+    st = path.stat()
+    os.utime(path, (st.st_atime, st.st_mtime + 1))
+
+
+def run_build(root : Path, jobs : int, deps : str, snapshot : bool) -> dict:
+    result_file = root / 'result.json'
+    env = dict(os.environ, PYSBS_BENCH_RESULT=str(result_file), PYSBS_BENCH_JOBS=str(jobs),
+               PYSBS_BENCH_DEPS=deps, PYSBS_BENCH_SNAPSHOT='1' if snapshot else '0')
+
+    start = time.perf_counter()
+    subprocess.run([sys.executable, root / 'build.py'], cwd=root, env=env,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+    total = time.perf_counter() - start
+
+    result = json.loads(result_file.read_text())
+    result['total_time'] = total
+    result['db_size'] = sum(i.stat().st_size for i in (root / 'build').glob('pysbs.db*'))
+    return result
+
+
+def run_scenario(root : Path, scenario : str, jobs : int, deps : str, snapshot : bool) -> dict:
+    if scenario == 'cold':
+        shutil.rmtree(root / 'build', ignore_errors=True)
+    elif scenario == 'edit_source':
+        touch(root / 'src' / 's0.c')
+    elif scenario == 'edit_header':
+        touch(root / 'include' / 'h0.h')
+    elif scenario == 'edit_script':
+        touch(root / 'build.py')
+    return run_build(root, jobs, deps, snapshot)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark pysbs on synthetic projects')
+    parser.add_argument('--sources', type=int, default=200)
+    parser.add_argument('--headers', type=int, default=100)
+    parser.add_argument('--fanout', type=int, default=3)
+    parser.add_argument('--depth', type=int, default=4)
+    parser.add_argument('--jobs', type=int, default=1)
+    parser.add_argument('--deps', choices=['steps', 'lazy', 'collapsed'], default='steps',
+                        help='How header dependencies are tracked: step per header, created lazily, or one fingerprint per source')
+    parser.add_argument('--snapshot', action='store_true', help='Load graph from snapshot when it is valid')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--scenario', choices=SCENARIOS, action='append', help='Run only given scenarios')
+    parser.add_argument('--output', type=Path, help='Write results into this JSON file')
+    opts = parser.parse_args()
+
+    results = {
+        'params': {
+            'sources': opts.sources, 'headers': opts.headers,
+            'fanout': opts.fanout, 'depth': opts.depth, 'jobs': opts.jobs,
+            'deps': opts.deps, 'snapshot': opts.snapshot
+        },
+        'scenarios': {}
+    }
+
+    # Project is generated near pysbs, see `generate.py`
+    with tempfile.TemporaryDirectory(prefix='project-', dir=Path(__file__).parent) as tmp:
+        root = Path(tmp)
+        generate_project(root, opts.sources, opts.headers, opts.fanout, opts.depth)
+
+        # Other scenarios need already built project
+        run_build(root, opts.jobs, opts.deps, opts.snapshot)
+
+        for scenario in opts.scenario or SCENARIOS:
+            runs = [ run_scenario(root, scenario, opts.jobs, opts.deps, opts.snapshot) for _ in range(opts.repeat) ]
+            # Best run is least affected by noise
+            best = min(runs, key=lambda i: i['total_time'])
+            results['scenarios'][scenario] = best
+
+            print(f'{scenario:12} total {best["total_time"]:7.3f}s  '
+                  f'graph {best["graph_time"]:7.3f}s  '
+                  f'scan {best["scan_time"]:7.3f}s  '
+                  f'dirty check {best["dirty_check_time"]:7.3f}s  '
+                  f'run {best["run_time"]:7.3f}s  '
+                  f'steps {best["dirty_steps"]:6}  '
+                  f'db {best["db_size"] / 1024:8.0f}KiB  '
+                  f'rss {best["peak_rss_kb"] / 1024:6.1f}MiB')
+
+    if opts.output:
+        opts.output.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -8,10 +8,11 @@ sys.path.append(str(PYSBS_DIR))
 ##### Begin build code
 
 from pysbs.c import CProject, CLinkingStep, CAutoCompilationStep
-from pysbs.core import use_database, build
+from pysbs.core import use_database, metrics
+from pysbs.core.cli import main
 from pysbs.misc.exec_step import generate_compile_commands
+from pysbs.misc.glob_step import GlobStep
 from pysbs.misc.invalidator import invalidate_if_needed
-import asyncio
 
 # Misc. files and folders
 
@@ -19,7 +20,10 @@ BUILD_FOLDER = THIS_FOLDER / 'build'
 INCLUDE_FOLDER = THIS_FOLDER / 'include'
 SRC_FOLDER = THIS_FOLDER / 'src'
 OUT_FILE = BUILD_FOLDER / 'hello.out'
-SOURCES = SRC_FOLDER.glob('**/*.c')
+
+# Print how long each phase of the build took
+
+metrics.report_at_exit()
 
 # Setup folder structure
 
@@ -33,11 +37,13 @@ project = CProject(
     include_paths=[INCLUDE_FOLDER]
 )
 
-# Make compilation steps for each source
+# Find sources, and make compilation steps for each of them
+
+sources = GlobStep(SRC_FOLDER, '**/*.c')
 
 compilation_steps = [
     CAutoCompilationStep(project, i, BUILD_FOLDER)
-    for i in SOURCES
+    for i in sources.files
 ]
 
 # Add step to link them together
@@ -46,12 +52,12 @@ linking_step = CLinkingStep(
     project,
     inputs=[ i.output for i in compilation_steps ],
     output=OUT_FILE,
-    dependencies=compilation_steps
+    dependencies=[sources, *compilation_steps]
 )
 
 # Build!
 
 generate_compile_commands([linking_step], BUILD_FOLDER / 'compile_commands.json', THIS_FOLDER)
-asyncio.run(build(linking_step))
+main({ 'hello': linking_step })
 
 
@@ -10,7 +10,7 @@ from pysbs.core.step import BuildStep
 from pysbs.c.project import CProject
 from pysbs.c.deps import CDependencyStep
 from pysbs.core.config import use_database
-from pysbs.misc.graphviz import make_dot_graph
+from pysbs.misc.graphviz import write_dot_graph
 from pathlib import Path
 
 import logging, coloredlogs
@@ -77,7 +77,6 @@ node[shape=box];
 rankdir=LR;
 """
 
-dot = make_dot_graph(steps, fmt=get_node_label, extra_graph_data=EXTRA_DOT, extra_note_attrs=get_node_props)
-
-open(THIS_FILE.parent / 'graph.dot', 'w').write(dot)
+with open(THIS_FILE.parent / 'graph.dot', 'w') as f:
+    write_dot_graph(steps, f, fmt=get_node_label, extra_graph_data=EXTRA_DOT, extra_note_attrs=get_node_props)
 
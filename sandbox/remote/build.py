@@ -0,0 +1,48 @@
+# Builds `cproject` example on worker servers.
+#
+# Start some workers first:
+#
+#   python -m pysbs.misc.worker --port 8719 --cache /tmp/worker-1 &
+#   python -m pysbs.misc.worker --port 8720 --cache /tmp/worker-2 &
+#
+# Then run this with their addresses:
+#
+#   python sandbox/remote/build.py localhost:8719 localhost:8720
+#
+# Workers on other machines need a token (`--host 0.0.0.0 --token ...`),
+# pass the same one in `PYSBS_WORKER_TOKEN` variable to this script.
+
+from pathlib import Path
+import sys
+
+THIS_FILE = Path(__file__)
+THIS_FOLDER = THIS_FILE.parent
+PYSBS_DIR = THIS_FOLDER.parent.parent
+sys.path.append(str(PYSBS_DIR))
+##### Begin build code
+
+from pysbs.c import CProject, CLinkingStep, CAutoCompilationStep
+from pysbs.core import use_database, build
+from pysbs.misc.executor import use_executor, RemoteExecutor
+import asyncio
+
+PROJECT_FOLDER = THIS_FOLDER.parent / 'cproject'
+BUILD_FOLDER = THIS_FOLDER / 'build'
+OUT_FILE = BUILD_FOLDER / 'hello.out'
+
+BUILD_FOLDER.mkdir(parents=True, exist_ok=True)
+use_database(BUILD_FOLDER / 'pysbs.db')
+use_executor(RemoteExecutor(sys.argv[1:]))
+
+project = CProject(
+    include_paths=[PROJECT_FOLDER / 'include']
+)
+
+compilation_steps = [
+    CAutoCompilationStep(project, i, BUILD_FOLDER)
+    for i in (PROJECT_FOLDER / 'src').glob('**/*.c')
+]
+
+linking_step = CLinkingStep(project, compilation_steps, OUT_FILE)
+
+asyncio.run(build(linking_step, jobs=len(sys.argv[1:]) or 1))
@@ -6,6 +6,7 @@ sys.path.append(dirname(dirname(dirname(__file__))))
 from pysbs.core.step import BuildStep
 from pysbs.core.build import build
 from pysbs.core.config import use_database
+from pysbs.core.pool import pooled
 import asyncio
 
 class FoobarBuildStep(BuildStep):
@@ -23,18 +24,21 @@ class FoobarBuildStep(BuildStep):
     def input_version(self) -> str:
         return str(getmtime(self.file))
 
-    async def run(self):
-        print(f'Compiling `{self.file}`')
+    # Pretend this is CPU-heavy, so run it in other process
+    @pooled('process')
+    def run(self):
+        self.print(f'Compiling `{self.file}`')
         with open(self.file, 'r') as f:
             conts = f.read()
             if 'fail' in conts:
-                print('Something wrong in the file')
+                self.print('Something wrong in the file')
                 self.fail()
 
-use_database(join(dirname(__file__), 'pysbs.db'))
+if __name__ == '__main__':
+    use_database(join(dirname(__file__), 'pysbs.db'))
 
-lib = FoobarBuildStep('./src/lib.foobar')
-other = FoobarBuildStep('./src/other.foobar', dependencies=[lib])
-main = FoobarBuildStep('./src/main.foobar', dependencies=[lib, other])
+    lib = FoobarBuildStep('./src/lib.foobar')
+    other = FoobarBuildStep('./src/other.foobar', dependencies=[lib])
+    main = FoobarBuildStep('./src/main.foobar', dependencies=[lib, other])
 
-asyncio.run(build(main))
+    asyncio.run(build(main, jobs=2))